@@ -1,8 +1,48 @@
+import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 
+class MultiTaskLoss(nn.Module):
+    """Weighted sum of the cross-entropies of the outputs of a model.
+    Output i is compared to the target (target_type[i] == "target0", output of size (N,2)) 
+    or to the classes of the two digits (target_type[i] == "target1", output of size (N,10,2)).
+    The routing is resolved once; at each call, the logits of all the outputs are padded 
+    to the same number of classes (with -inf) and stacked, so that all the cross-entropies
+    are computed by a single weighted reduction."""
+
+    def __init__(self, target_type, weights_loss):
+        super().__init__()
+        routes = {"target0": 0, "target1": 1}
+        for target in target_type:
+            if target not in routes:
+                raise ValueError("Unexpected value in the attribute target_type")
+        self.routes = [routes[target] for target in target_type]
+        self.register_buffer("weights", torch.tensor(weights_loss, dtype=torch.float), persistent=False)
+        self.row_weights = {} # Weight of each stacked row, for each batch size
+    
+    def forward(self, output, target, classes):
+        if len(self.routes) == 1:
+            # One output : no auxiliary losses
+            return F.cross_entropy(output, (target, classes)[self.routes[0]])*self.weights[0]
+        # Each output as rows of logits: (N,C) for target0, (N*2,C) for target1
+        logits = [out if route == 0 else out.transpose(1, 2).reshape(-1, out.shape[1])
+                  for out, route in zip(output, self.routes)]
+        targets = [(target, classes)[route].reshape(-1) for route in self.routes]
+        nb_classes = max(rows.shape[1] for rows in logits)
+        logits = torch.cat([F.pad(rows, (0, nb_classes - rows.shape[1]), value=-math.inf)
+                            for rows in logits])
+        # Each row is weighted by the weight of its output divided by the number of rows of the 
+        # output (i.e. the mean of each cross-entropy)
+        key = (target.shape[0], logits.device)
+        if key not in self.row_weights:
+            counts = torch.tensor([rows.shape[0] for rows in targets], device=logits.device)
+            self.row_weights[key] = torch.repeat_interleave(self.weights.to(logits.device)/counts, counts)
+        losses = F.cross_entropy(logits, torch.cat(targets), reduction="none")
+        return torch.dot(losses, self.row_weights[key])
+
+
 class Naive_net(nn.Module):
 
     def __init__(self):
@@ -24,6 +64,7 @@ class Naive_net(nn.Module):
         )
         self.target_type = ["target0"]
         self.weights_loss = [1]
+        self.criterion = MultiTaskLoss(self.target_type, self.weights_loss)
 
     def forward(self,input):
         output = self.sequence(input)
@@ -76,7 +117,7 @@ class ResBlock(nn.Module):
         y = self.bn1(self.conv1(x))
         y = F.relu(y)
         y = self.bn2(self.conv2(y))
-        y += x
+        y = y + x
         y = F.relu(y)
         return y
         
@@ -111,7 +152,7 @@ class MnistResNet(nn.Module):
     
     def forward(self, input):
         output = self.sequence(input)
-        return ouput
+        return output
         
 
 class Simple_Net(nn.Module):
@@ -153,8 +194,12 @@ class Simple_Net(nn.Module):
 
 class CrossArchitecture(nn.Module):
 
-    def __init__(self):
+    def __init__(self, fold_siamese=False):
+        """fold_siamese: fold the two digits into the batch dimension so that MnistNet is run once
+        on (N*2,1,14,14) instead of twice on (N,1,14,14). Identical in eval mode; in train mode the
+        BatchNorm statistics are computed over both digits together."""
         super().__init__()
+        self.fold_siamese = fold_siamese
         self.MnistNet = MnistCNN()
         self.NaiveNet = Naive_net()
         self.SimpleNet = Simple_Net()
@@ -163,11 +208,14 @@ class CrossArchitecture(nn.Module):
         self.Linear1 = nn.Linear(22,11)
         self.Linear2 = nn.Linear(11,2)
         self.weights_loss = [0.5,0.5]
+        self.criterion = MultiTaskLoss(self.target_type, self.weights_loss)
     
     def forward(self,input):
         """MnistCNN outputs a prediction for both digits, NaiveNet outputs the predicted comparison.
         No weights shared up to that point. Then, two linear layers take these predictions as input (size N*22).
         Output: predicted comparison of the two digits."""
+        if self.fold_siamese:
+            return self.forward_folded(input)
         num1 = input[:,[0],:,:]
         num2 = input[:,[1],:,:]
         output_naive = self.NaiveNet(input) # shape = (N,2)
@@ -181,12 +229,28 @@ class CrossArchitecture(nn.Module):
         output1 = self.Linear2(output1) # shape = (N,2)
         return output1, output2
 
+    def forward_folded(self,input):
+        """Same as forward with both digits pushed through MnistNet in one call"""
+        N = input.shape[0]
+        output_naive = self.NaiveNet(input) # shape = (N,2)
+        output_num = self.MnistNet(input.flatten(0,1).unsqueeze(1)) # shape = (N*2,10)
+        output_num = output_num.view(N,2,-1) # shape = (N,2,10)
+        output2 = output_num.transpose(1,2) # shape = (N,10,2)
+        output1 = torch.cat((output_num.view(N,-1),output_naive),dim=1) # shape = (N,22)
+        output1 = self.Linear1(output1)
+        output1 = self.Linear2(output1) # shape = (N,2)
+        return output1, output2
+
 class oO_Net(nn.Module):
     
-    def __init__(self, use_MnistResNet=False):
+    def __init__(self, use_MnistResNet=False, fold_siamese=False):
+        """fold_siamese: fold the two digits into the batch dimension so that Mnist_part and 
+        post_mnist_sequence are run once on both digits instead of twice (see CrossArchitecture)"""
         super().__init__()
+        self.fold_siamese = fold_siamese
         self.target_type = ["target0","target1"]
         self.weights_loss = [0.5,0.5]
+        self.criterion = MultiTaskLoss(self.target_type, self.weights_loss)
         
         if use_MnistResNet:
             nb_blocks = MnistResNet().nb_blocks
@@ -218,6 +282,8 @@ class oO_Net(nn.Module):
         )
         
     def forward(self,input):
+        if self.fold_siamese:
+            return self.forward_folded(input)
         num1 = input[:,[0],:,:]
         num2 = input[:,[1],:,:]
         upper_output1 = self.Mnist_part(num1).view(num1.shape[0],-1,1)
@@ -246,4 +312,25 @@ class oO_Net(nn.Module):
         output_down = torch.cat((upper_part1,upper_part2,lower_part),dim=1)
         output_down = self.lower_last_sequence(output_down)
         
-        return output_down, output_up
\ No newline at end of file
+        return output_down, output_up
+
+    def forward_folded(self,input):
+        """Same as forward with both digits pushed through the shared parts in one call"""
+        N = input.shape[0]
+        upper_output = self.Mnist_part(input.flatten(0,1).unsqueeze(1)) # shape = (N*2,64)
+        lower_output = self.Naive_part(input) # shape = (N,128)
+        
+        # Sum both outputs, with the digits kept in the batch dimension
+        both_parts = lower_output.view(N,-1,2).transpose(1,2) + upper_output.view(N,2,-1) # shape = (N,2,64)
+        
+        # Then, take upper and lower parts to sizes 10 and 2 respectively
+        upper_part = self.post_mnist_sequence(both_parts.reshape(2*N,-1)).view(N,2,-1) # shape = (N,2,10)
+        lower_part = self.post_naive_sequence(both_parts.transpose(1,2).reshape(N,-1))
+        
+        # Form the final outputs
+        output_up = upper_part.transpose(1,2) # shape = (N,10,2)
+        
+        output_down = torch.cat((upper_part.view(N,-1),lower_part),dim=1)
+        output_down = self.lower_last_sequence(output_down)
+        
+        return output_down, output_up
@@ -0,0 +1,193 @@
+import os
+import json
+import torch
+import torch.nn as nn
+from time import perf_counter
+
+
+def input_channels(model):
+    """
+    Goal:
+    Infer the number of channels of the (Nxchannelsx14x14) input of a model: the input channels
+    of its Conv2d layers are tried in order (the first registered conv is not always the one
+    applied to the input, e.g. the digit trunk of CrossArchitecture takes 1 channel of its
+    2 channel input)
+    Inputs:
+    model = nn.Module
+    Outputs:
+    channels = int
+    """
+    candidates = []
+    for module in model.modules():
+        if isinstance(module,nn.Conv2d) and module.in_channels not in candidates:
+            candidates.append(module.in_channels)
+    training = model.training
+    model.eval()
+    try:
+        for channels in candidates:
+            try:
+                with torch.no_grad():
+                    model(torch.zeros(2,channels,14,14))
+                return channels
+            except (RuntimeError,IndexError):
+                pass # Wrong number of channels
+    finally:
+        model.train(training)
+    raise ValueError("Cannot infer the number of input channels of " + type(model).__name__)
+
+
+class CPUProfile():
+
+    def __init__(self,path=None,thread_candidates=None,repeats=5):
+        """
+        Goal:
+        CPU execution profile of the architectures: for each (architecture, batch size,
+        training or inference) the memory format (channels_last or not) and the number of
+        intra-op threads giving the fastest step are measured once and persisted as JSON
+        Inputs:
+        path = string or None - JSON file where the configurations are persisted (loaded if it
+               exists), None to keep them in memory only
+        thread_candidates = list of int or None - numbers of threads tried, None for the powers
+                            of 2 up to the number of cores (and the number of cores)
+        repeats = int - number of timed steps per candidate configuration
+        Outputs:
+        """
+        self.path = path
+        if thread_candidates is None:
+            cores = os.cpu_count() or 1
+            thread_candidates = sorted({2**k for k in range(cores.bit_length()) if 2**k <= cores} | {cores})
+        self.thread_candidates = thread_candidates
+        self.repeats = repeats
+        # Inter-op threads are only used by forked jit graphs: they are set once per process,
+        # torch does not allow to change them after the first parallel operation
+        self.num_interop_threads = 1
+        self.configs = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                self.configs = json.load(file)
+
+    def key(self,Myclass,args,batch_size,training):
+        name = Myclass.__name__ + ("" if not args else repr(list(args)))
+        return "{}/{:d}/{}".format(name,batch_size,"train" if training else "inference")
+
+    def time_step(self,model,input,training):
+        """
+        Goal:
+        Median time of a training step (forward and backward) or of an inference step
+        Inputs:
+        model = nn.Module
+        input = tensor - input of the model
+        training = bool
+        Outputs:
+        time = float - median time in seconds
+        """
+        times = []
+        for i in range(self.repeats + 1):
+            start = perf_counter()
+            if training:
+                output = model(input)
+                if isinstance(output,tuple):
+                    output = output[0]
+                model.zero_grad()
+                output.logsumexp(dim=1).mean().backward()
+            else:
+                with torch.inference_mode():
+                    model(input)
+            times.append(perf_counter() - start)
+        return sorted(times[1:])[self.repeats//2]
+
+    def tune(self,Myclass,args,batch_size,channels=None,training=True):
+        """
+        Goal:
+        Measure every candidate configuration of an architecture and store the fastest one
+        Inputs:
+        Myclass = class generating the architecture
+        args = list of the arguments of the class
+        batch_size = int
+        channels = int or None - number of channels of the (Nxchannelsx14x14) input, 
+                   None to infer it from the model (see input_channels)
+        training = bool - tune the training step or the inference
+        Outputs:
+        config = dict - {"channels_last": bool, "num_threads": int, "time": float}
+        """
+        previous_threads = torch.get_num_threads()
+        model = Myclass(*args).train(training)
+        if channels is None:
+            channels = input_channels(model)
+        input = torch.rand(batch_size,channels,14,14)
+        best = None
+        for channels_last in [False,True]:
+            if channels_last:
+                model = model.to(memory_format=torch.channels_last)
+                input = input.contiguous(memory_format=torch.channels_last)
+            for num_threads in self.thread_candidates:
+                torch.set_num_threads(num_threads)
+                time = self.time_step(model,input,training)
+                if best is None or time < best["time"]:
+                    best = {"channels_last": channels_last, "num_threads": num_threads, "time": time}
+        torch.set_num_threads(previous_threads)
+        self.configs[self.key(Myclass,args,batch_size,training)] = best
+        self.save()
+        return best
+
+    def config(self,Myclass,args,batch_size,channels=None,training=True):
+        """
+        Goal:
+        Return the configuration of an architecture, tuned on first use (see tune)
+        Inputs:
+        see tune
+        Outputs:
+        config = dict - {"channels_last": bool, "num_threads": int, "time": float}
+        """
+        key = self.key(Myclass,args,batch_size,training)
+        if key not in self.configs:
+            return self.tune(Myclass,args,batch_size,channels,training)
+        return self.configs[key]
+
+    def convert(self,x,config):
+        """
+        Goal:
+        Convert a model or a 4D input tensor to the memory format of a configuration
+        Inputs:
+        x = nn.Module or tensor
+        config = dict - see config
+        Outputs:
+        x = nn.Module or tensor - converted
+        """
+        if not config["channels_last"]:
+            return x
+        if isinstance(x,torch.Tensor):
+            return x.contiguous(memory_format=torch.channels_last) if x.dim() == 4 else x
+        return x.to(memory_format=torch.channels_last)
+
+    def set_threads(self,config):
+        """
+        Goal:
+        Use the number of threads of a configuration in this process
+        Inputs:
+        config = dict - see config
+        Outputs:
+        """
+        torch.set_num_threads(config["num_threads"])
+        try:
+            torch.set_num_interop_threads(self.num_interop_threads)
+        except RuntimeError:
+            pass # Already set
+
+    def save(self):
+        """
+        Goal:
+        Persist the configurations in self.path (if any)
+        Inputs:
+        Outputs:
+        """
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory,exist_ok=True)
+        # Write to a temporary file first so that a reader never sees a partial file
+        tmp_path = self.path + '.tmp{:d}'.format(os.getpid())
+        with open(tmp_path,"w") as file:
+            json.dump(self.configs,file,indent=1,sort_keys=True)
+        os.replace(tmp_path,self.path)
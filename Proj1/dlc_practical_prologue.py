@@ -1,8 +1,8 @@
 
 import torch
-from torchvision import datasets
 
 import argparse
+import gzip
 import os
 
 ######################################################################
@@ -38,6 +38,48 @@ args = parser.parse_args()
 if args.seed >= 0:
     torch.manual_seed(args.seed)
 
+######################################################################
+# Native reader of the MNIST IDX files (no torchvision, no download)
+
+def read_idx(path, chunk_size = 1 << 20):
+    # Memory-map the uncompressed file if it exists, else stream the gzip'd
+    # one in chunks, in both cases straight into an uint8 tensor
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            dims = read_idx_header(f, path)
+        size = os.path.getsize(path)
+        data = torch.from_file(path, shared = False, size = size, dtype = torch.uint8)
+        return data[4 * (len(dims) + 1):].view(dims)
+    if os.path.exists(path + '.gz'):
+        with gzip.open(path + '.gz', 'rb') as f:
+            dims = read_idx_header(f, path + '.gz')
+            buffer = bytearray(torch.Size(dims).numel())
+            view = memoryview(buffer)
+            position = 0
+            while position < len(buffer):
+                nb_read = f.readinto(view[position:position + chunk_size])
+                if nb_read == 0:
+                    raise ValueError('Truncated IDX file ' + path + '.gz')
+                position += nb_read
+        return torch.frombuffer(buffer, dtype = torch.uint8).view(dims)
+    raise FileNotFoundError('Cannot find ' + path + ' nor ' + path + '.gz')
+
+def read_idx_header(f, path):
+    magic = f.read(4)
+    if len(magic) < 4 or magic[0] != 0 or magic[1] != 0 or magic[2] != 0x08:
+        raise ValueError('Not an uint8 IDX file ' + path)
+    nb_dims = magic[3]
+    header = f.read(4 * nb_dims)
+    return [int.from_bytes(header[4 * i:4 * (i + 1)], 'big') for i in range(nb_dims)]
+
+def load_mnist(data_dir, train = True):
+    # Returns the uint8 images (N x 1 x 28 x 28) and the int64 labels
+    raw_dir = os.path.join(data_dir, 'mnist', 'MNIST', 'raw')
+    prefix = 'train' if train else 't10k'
+    input = read_idx(os.path.join(raw_dir, prefix + '-images-idx3-ubyte'))
+    target = read_idx(os.path.join(raw_dir, prefix + '-labels-idx1-ubyte'))
+    return input.view(-1, 1, 28, 28), target.long()
+
 ######################################################################
 # The data
 
@@ -57,6 +99,7 @@ def load_data(cifar = None, one_hot_labels = False, normalize = False, flatten =
 
     if args.cifar or (cifar is not None and cifar):
         print('* Using CIFAR')
+        from torchvision import datasets
         cifar_train_set = datasets.CIFAR10(data_dir + '/cifar10/', train = True, download = True)
         cifar_test_set = datasets.CIFAR10(data_dir + '/cifar10/', train = False, download = True)
 
@@ -70,13 +113,9 @@ def load_data(cifar = None, one_hot_labels = False, normalize = False, flatten =
 
     else:
         print('* Using MNIST')
-        mnist_train_set = datasets.MNIST(data_dir + '/mnist/', train = True, download = True)
-        mnist_test_set = datasets.MNIST(data_dir + '/mnist/', train = False, download = True)
-
-        train_input = mnist_train_set.data.view(-1, 1, 28, 28).float()
-        train_target = mnist_train_set.targets
-        test_input = mnist_test_set.data.view(-1, 1, 28, 28).float()
-        test_target = mnist_test_set.targets
+        # Kept as uint8, converted to float once the data-set has been reduced
+        train_input, train_target = load_mnist(data_dir, train = True)
+        test_input, test_target = load_mnist(data_dir, train = False)
 
     if flatten:
         train_input = train_input.clone().reshape(train_input.size(0), -1)
@@ -99,6 +138,8 @@ def load_data(cifar = None, one_hot_labels = False, normalize = False, flatten =
             test_input = test_input.narrow(0, 0, 1000)
             test_target = test_target.narrow(0, 0, 1000)
 
+    train_input, test_input = train_input.float(), test_input.float()
+
     print('** Use {:d} train and {:d} test samples'.format(train_input.size(0), test_input.size(0)))
 
     if one_hot_labels:
@@ -114,34 +155,139 @@ def load_data(cifar = None, one_hot_labels = False, normalize = False, flatten =
 
 ######################################################################
 
+def random_pair_index(nb, size, generator = None):
+    # Indices of nb pairs of distinct images drawn among size images
+    # (with replacement if there are not enough images)
+    if 2 * nb > size:
+        return torch.randint(size, (nb, 2), generator = generator)
+    a = torch.randperm(size, generator = generator)
+    return a[:2 * nb].view(nb, 2)
+
+class PairDataset:
+    # Lazy view on pairs of images: one bank of images and the (N x 2) indices of
+    # the pairs, the pairs are only gathered (and pooled) when they are accessed
+
+    def __init__(self, input, target, index, pool = True):
+        self.input = input # Bank of images, M x 1 x H x W
+        self.target = target # Classes of the images, M
+        self.index = index # Indices of the pairs, N x 2
+        self.pool = pool # Pool the 28x28 images to 14x14 when they are gathered
+
+    def __len__(self):
+        return self.index.size(0)
+
+    def __getitem__(self, i):
+        # Returns the input (k x 2 x 14 x 14), target (k) and classes (k x 2) of the pairs i
+        a = self.index[i].view(-1, 2)
+        # The two images of a pair are consecutive
+        input = self.input[a.reshape(-1)].float()
+        if self.pool:
+            input = torch.functional.F.avg_pool2d(input, kernel_size = 2)
+        input = input.view(a.size(0), 2, *input.shape[2:])
+        classes = self.target[a]
+        target = (classes[:, 0] <= classes[:, 1]).long()
+        return input, target, classes
+
+    def subset(self, i):
+        # View on the pairs i, nothing is copied but the indices
+        return PairDataset(self.input, self.target, self.index[i].view(-1, 2), self.pool)
+
+    def resample(self, nb = None, generator = None):
+        # New pairing of the same bank of images
+        if nb is None:
+            nb = len(self)
+        index = random_pair_index(nb, self.input.size(0), generator)
+        return PairDataset(self.input, self.target, index, self.pool)
+
 def mnist_to_pairs(nb, input, target):
-    input = torch.functional.F.avg_pool2d(input, kernel_size = 2)
-    a = torch.randperm(input.size(0))
-    a = a[:2 * nb].view(nb, 2)
-    input = torch.cat((input[a[:, 0]], input[a[:, 1]]), 1)
-    classes = target[a]
-    target = (classes[:, 0] <= classes[:, 1]).long()
-    return input, target, classes
+    # Only the sampled images are converted and pooled
+    a = random_pair_index(nb, input.size(0))
+    return PairDataset(input, target, a)[:]
 
 ######################################################################
 
-def generate_pair_sets(nb):
+def get_data_dir():
     if args.data_dir is not None:
-        data_dir = args.data_dir
-    else:
-        data_dir = os.environ.get('PYTORCH_DATA_DIR')
-        if data_dir is None:
-            data_dir = './data'
+        return args.data_dir
+    data_dir = os.environ.get('PYTORCH_DATA_DIR')
+    if data_dir is None:
+        data_dir = './data'
+    return data_dir
 
-    train_set = datasets.MNIST(data_dir + '/mnist/', train = True, download = True)
-    train_input = train_set.data.view(-1, 1, 28, 28).float()
-    train_target = train_set.targets
+######################################################################
+# On-disk cache of the pair sets
+
+# Bump when the content or the layout of the cached files changes
+CACHE_VERSION = 1
+
+def save_atomic(obj, path):
+    # Write to a temporary file first so that a reader never sees a partial file
+    tmp_path = path + '.tmp{:d}'.format(os.getpid())
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def load_mnist_bank(data_dir, cache_dir):
+    # 14x14 pooled MNIST images and labels, stored once per cache version,
+    # loaded as memory-mapped tensors
+    path = os.path.join(cache_dir, 'mnist14_v{:d}.pt'.format(CACHE_VERSION))
+    if not os.path.exists(path):
+        bank = {}
+        for split, train in [('train', True), ('test', False)]:
+            input, target = load_mnist(data_dir, train = train)
+            bank[split + '_input'] = torch.functional.F.avg_pool2d(input.float(), kernel_size = 2)
+            bank[split + '_target'] = target
+        os.makedirs(cache_dir, exist_ok = True)
+        save_atomic(bank, path)
+    return torch.load(path, mmap = True)
+
+def load_pair_index(nb, seed, bank, cache_dir):
+    # Indices of the pairs, stored per seed and size
+    path = os.path.join(cache_dir, 'pairs_v{:d}_seed{:d}_nb{:d}.pt'.format(CACHE_VERSION, seed, nb))
+    if not os.path.exists(path):
+        generator = torch.Generator().manual_seed(seed)
+        index = {}
+        for split in ['train', 'test']:
+            index[split] = random_pair_index(nb, bank[split + '_input'].size(0), generator).clone()
+        save_atomic(index, path)
+    return torch.load(path, mmap = True)
+
+def cached_pair_datasets(nb, cache_dir, seed = None):
+    if seed is None:
+        seed = args.seed
+    bank = load_mnist_bank(get_data_dir(), cache_dir)
+    datasets = []
+    if seed < 0:
+        # No seeding: only the images are cached, the pairs are drawn with the global generator
+        index = {split: random_pair_index(nb, bank[split + '_input'].size(0)) for split in ['train', 'test']}
+    else:
+        index = load_pair_index(nb, seed, bank, cache_dir)
+    for split in ['train', 'test']:
+        datasets.append(PairDataset(bank[split + '_input'], bank[split + '_target'], index[split], pool = False))
+    return datasets
 
-    test_set = datasets.MNIST(data_dir + '/mnist/', train = False, download = True)
-    test_input = test_set.data.view(-1, 1, 28, 28).float()
-    test_target = test_set.targets
+######################################################################
 
-    return mnist_to_pairs(nb, train_input, train_target) + \
-           mnist_to_pairs(nb, test_input, test_target)
+def generate_pair_datasets(nb, cache_dir = None):
+    # Returns the lazy train and test PairDataset
+    if cache_dir is not None:
+        return cached_pair_datasets(nb, cache_dir)
+
+    data_dir = get_data_dir()
+    datasets = []
+    for train in [True, False]:
+        input, target = load_mnist(data_dir, train = train)
+        # The bank is kept by the lazy view: copy it out of the memory-mapped IDX file
+        # (see read_idx), which cannot be pickled to the worker processes
+        datasets.append(PairDataset(input.clone(), target, random_pair_index(nb, input.size(0))))
+    return datasets
+
+def generate_pair_sets(nb, cache_dir = None, lazy = False):
+    # With a cache_dir, the pooled images and the pair indices (keyed by seed and nb)
+    # are stored there and memory-mapped on the next calls.
+    # With lazy, returns the train and test PairDataset instead of the materialized tensors
+    train_set, test_set = generate_pair_datasets(nb, cache_dir)
+    if lazy:
+        return train_set, test_set
+    return train_set[:] + test_set[:]
 
 ######################################################################
\ No newline at end of file
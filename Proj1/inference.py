@@ -0,0 +1,221 @@
+import copy
+import torch
+import torch.nn as nn
+from time import perf_counter
+from architecture import *
+
+
+def bn_affine(bn):
+    """
+    Goal:
+    Write an eval-mode BatchNorm as a per-channel affine map y = scale*x + shift
+    Inputs:
+    bn = nn.BatchNorm1d or nn.BatchNorm2d
+    Outputs:
+    scale = tensor - size (C)
+    shift = tensor - size (C)
+    """
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    if bn.affine:
+        scale = scale*bn.weight
+    shift = -bn.running_mean*scale
+    if bn.affine:
+        shift = shift + bn.bias
+    return scale, shift
+
+
+def fold_into_previous(layer,bn):
+    """
+    Goal:
+    Fold bn into the layer it directly follows: bn(layer(x)) = layer'(x)
+    Inputs:
+    layer = nn.Conv2d or nn.Linear
+    bn = nn.BatchNorm1d or nn.BatchNorm2d - with as many channels as the outputs of layer
+    Outputs:
+    """
+    scale, shift = bn_affine(bn)
+    if layer.bias is None:
+        layer.bias = nn.Parameter(torch.zeros_like(shift))
+    layer.weight.mul_(scale.view(-1,*[1]*(layer.weight.dim() - 1)))
+    layer.bias.mul_(scale).add_(shift)
+
+
+def fold_into_next(bn,layer,flatten=False):
+    """
+    Goal:
+    Fold bn into the layer that directly follows it: layer(bn(x)) = layer'(x)
+    (a conv must not be padded, the padding would not be shifted by bn)
+    Inputs:
+    bn = nn.BatchNorm1d or nn.BatchNorm2d
+    layer = nn.Conv2d or nn.Linear
+    flatten = bool - an nn.Flatten is between bn and layer (layer is a nn.Linear)
+    Outputs:
+    """
+    scale, shift = bn_affine(bn)
+    if flatten:
+        # Each channel is repeated over its spatial positions
+        spatial = layer.in_features//scale.numel()
+        scale, shift = scale.repeat_interleave(spatial), shift.repeat_interleave(spatial)
+    if layer.bias is None:
+        layer.bias = nn.Parameter(torch.zeros(layer.weight.shape[0]))
+    # The contribution of the shift: sum over the inputs of weight*shift
+    weight = layer.weight.view(layer.weight.shape[0],scale.numel(),-1)
+    layer.bias.add_((weight*shift.view(1,-1,1)).sum(dim=(1,2)))
+    weight.mul_(scale.view(1,-1,1))
+
+
+def is_batchnorm(module):
+    return isinstance(module,(nn.BatchNorm1d,nn.BatchNorm2d)) and module.track_running_stats
+
+
+def can_fold_into_next(module):
+    if isinstance(module,nn.Linear):
+        return True
+    return isinstance(module,nn.Conv2d) and module.groups == 1 and \
+           all(p == 0 for p in module.padding) and module.padding_mode == "zeros"
+
+
+def fold_sequence(sequence):
+    """
+    Goal:
+    Fold the BatchNorms of an nn.Sequential into the conv/linear layers around them and remove
+    the Dropouts and the folded BatchNorms
+    Inputs:
+    sequence = nn.Sequential
+    Outputs:
+    sequence = nn.Sequential - the folded sequence (the layers are shared with the input)
+    """
+    # Dropout is the identity in eval mode
+    modules = [m for m in sequence if not isinstance(m,(nn.Dropout,nn.Identity))]
+    kept = []
+    for i,module in enumerate(modules):
+        if is_batchnorm(module):
+            previous = kept[-1] if kept else None
+            following = modules[i + 1] if i + 1 < len(modules) else None
+            flatten = isinstance(following,nn.Flatten) and i + 2 < len(modules)
+            if flatten:
+                following = modules[i + 2]
+            if isinstance(previous,(nn.Conv2d,nn.Linear)) and previous.weight.shape[0] == module.num_features:
+                fold_into_previous(previous,module)
+                continue
+            if can_fold_into_next(following) and (flatten or isinstance(module,nn.BatchNorm1d) == isinstance(following,nn.Linear)):
+                fold_into_next(module,following,flatten)
+                continue
+        kept.append(module)
+    return nn.Sequential(*kept)
+
+
+def fold_batchnorm(model):
+    """
+    Goal:
+    Return an inference copy of a model where every eval-mode BatchNorm that is directly before or
+    after a conv/linear layer is folded into its weights and the Dropouts are removed.
+    BatchNorms that cannot be folded (e.g. between a ReLU and a ResBlock) are kept
+    Inputs:
+    model = nn.Module - one of the architectures (or any model made of nn.Sequential and ResBlock)
+    Outputs:
+    folded = nn.Module - copy of the model in eval mode, with the same outputs as model.eval()
+    """
+    folded = copy.deepcopy(model).eval()
+    with torch.no_grad():
+        for module in list(folded.modules()):
+            if isinstance(module,ResBlock):
+                fold_into_previous(module.conv1,module.bn1)
+                fold_into_previous(module.conv2,module.bn2)
+                module.bn1, module.bn2 = nn.Identity(), nn.Identity()
+            for name,child in module.named_children():
+                if isinstance(child,nn.Sequential):
+                    setattr(module,name,fold_sequence(child))
+    return folded
+
+
+def compile_for_inference(model,example_input):
+    """
+    Goal:
+    Fold the BatchNorms of a model (see fold_batchnorm) and freeze it as a TorchScript module.
+    The model is scripted when possible and traced on example_input otherwise
+    Inputs:
+    model = nn.Module
+    example_input = tensor - input of the model (used for tracing)
+    Outputs:
+    compiled = torch.jit.ScriptModule - frozen module, for inference only
+    """
+    folded = fold_batchnorm(model)
+    # The loss is not needed for inference
+    if hasattr(folded,"criterion"):
+        del folded.criterion
+    try:
+        compiled = torch.jit.script(folded)
+    except Exception:
+        with torch.no_grad():
+            compiled = torch.jit.trace(folded,example_input)
+    return torch.jit.freeze(compiled.eval())
+
+
+def randomize_batchnorm(model):
+    """
+    Goal:
+    Give the BatchNorms of a model non trivial statistics and affine parameters (in place),
+    so that folding them can be checked on an untrained model
+    Inputs:
+    model = nn.Module
+    Outputs:
+    model = nn.Module - the same model
+    """
+    with torch.no_grad():
+        for module in model.modules():
+            if is_batchnorm(module):
+                module.running_mean.uniform_(-1,1)
+                module.running_var.uniform_(0.5,2)
+                module.weight.uniform_(0.5,1.5)
+                module.bias.uniform_(-1,1)
+    return model
+
+
+def max_difference(output,reference):
+    """
+    Goal:
+    Maximal absolute difference between two outputs (tensors or tuples of tensors)
+    """
+    if isinstance(output,torch.Tensor):
+        output, reference = (output,), (reference,)
+    return max((o - r).abs().max().item() for o,r in zip(output,reference))
+
+
+def latency(model,input,repeats=20):
+    """
+    Goal:
+    Median time of a forward pass of the model
+    Inputs:
+    model = callable
+    input = tensor
+    repeats = int - number of timed forward passes (after 3 warm-up passes)
+    Outputs:
+    latency = float - median time in seconds
+    """
+    times = []
+    with torch.inference_mode():
+        for i in range(repeats + 3):
+            start = perf_counter()
+            model(input)
+            times.append(perf_counter() - start)
+    return sorted(times[3:])[repeats//2]
+
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+    # Architectures with the number of channels of their input
+    architectures = [(Naive_net,2),(MnistCNN,1),(MnistResNet,1),(Simple_Net,1),
+                     (CrossArchitecture,2),(oO_Net,2)]
+    row_format = '{:<20}{:<12}{:<15}{:<15}{:<15}{:<10}'
+    print(row_format.format("Architecture","Batch size","Max diff","Eager (ms)","Compiled (ms)","Speedup"))
+    for Myclass,channels in architectures:
+        model = randomize_batchnorm(Myclass()).eval()
+        compiled = compile_for_inference(model,torch.rand(2,channels,14,14))
+        for batch_size in [1,64,1024]:
+            input = torch.rand(batch_size,channels,14,14)
+            with torch.no_grad():
+                diff = max_difference(compiled(input),model(input))
+            eager, fast = latency(model,input), latency(compiled,input)
+            print(row_format.format(Myclass.__name__,batch_size,"{:.1e}".format(diff),
+                                    round(eager*1e3,3),round(fast*1e3,3),round(eager/fast,2)))
@@ -1,22 +1,204 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+import math
 import matplotlib.pyplot as plt
 import matplotlib
 import pandas as pd
 import seaborn as sns
 import numpy as np
 from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 from dlc_practical_prologue import generate_pair_sets
-import torchvision.transforms as transform
+from architecture import MultiTaskLoss
+from profiler import LayerProfiler
+
+
+def augment(input,degrees=20,p=0.3,scale=0.025,generator=None):
+    """
+    Goal:
+    Batched data augmentation: each image (i.e. each of the two digits of each pair) is rotated
+    by its own random angle in [-degrees,degrees] (one affine_grid/grid_sample call for the
+    whole batch), then with probability p a random square of area scale*H*W is erased (set to 0)
+    Inputs:
+    input = tensor - size (NxCxHxW)
+    degrees = float - maximal rotation angle in degrees
+    p = float - probability that the random erasing operation will be performed
+    scale = float - proportion of erased area against input image
+    generator = torch Generator or None - generator used to draw the transformations
+    Outputs:
+    augmented = tensor - size (NxCxHxW)
+    """
+    N, C, H, W = input.shape
+    images = input.reshape(N*C,1,H,W)
+    # Rotation matrices of all the images
+    angles = (torch.rand(N*C,generator=generator)*2 - 1)*degrees*math.pi/180
+    cos, sin = angles.cos(), angles.sin()
+    theta = torch.zeros(N*C,2,3,dtype=images.dtype)
+    theta[:,0,0], theta[:,0,1] = cos, -sin
+    theta[:,1,0], theta[:,1,1] = sin, cos
+    grid = F.affine_grid(theta,images.shape,align_corners=False)
+    augmented = F.grid_sample(images,grid,align_corners=False)
+    # Random erasing: vectorized masks of the squares
+    size = max(1,int(round(math.sqrt(scale*H*W))))
+    top = torch.randint(H - size + 1,(N*C,1),generator=generator)
+    left = torch.randint(W - size + 1,(N*C,1),generator=generator)
+    rows, cols = torch.arange(H).view(1,-1), torch.arange(W).view(1,-1)
+    mask_rows = (rows >= top) & (rows < top + size)
+    mask_cols = (cols >= left) & (cols < left + size)
+    erase = torch.rand(N*C,generator=generator) < p
+    mask = mask_rows.unsqueeze(2) & mask_cols.unsqueeze(1) & erase.view(-1,1,1)
+    augmented.masked_fill_(mask.unsqueeze(1),0)
+    return augmented.view(N,C,H,W)
+
+
+class Trainer():
+
+    def __init__(self, model, train_input, train_target, train_classes,
+                 mini_batch_size = 100, 
+                 eta = 0.05,
+                 augmentation = None,
+                 bf16 = False):
+        """
+        Goal:
+        Resumable training of a given model: the loss and the optimizer (and thus the moment 
+        estimates of Adam) are created once and kept between the calls of advance
+        Inputs:
+        model = nn.Module class object - model you want to train
+        train_input = tensor - size (Nx2x14x14) (N number of samples)
+                      input of the training datas
+        train_target = tensor - size (N) (N number of samples)
+                       targets - belongs to {0,1}
+        train_classes = tensor - size (Nx2) (N number of samples)
+                        Classes (i.e. numbers) of the two images - belongs to {1,...,10}
+        mini_batch_size = int - size of the mini batch size
+        eta = float - learning rate 
+        augmentation = function or None - augmentation(input,generator) returns the augmented input 
+                       (e.g. augment), it is computed on a background thread for the next epoch
+                       while the current one is trained
+        bf16 = bool - compute the forward pass and the loss under bfloat16 autocast, 
+               the weights and the optimizer state stay in float32
+        Outputs:
+        """
+        self.model = model
+        self.bf16 = bf16
+        self.train_input = train_input
+        self.train_target = train_target
+        self.train_classes = train_classes
+        self.mini_batch_size = mini_batch_size
+        # Define the loss (see MultiTaskLoss), built from target_type and weights_loss
+        # if the model does not define it
+        if hasattr(model, "criterion"):
+            self.criterion = model.criterion
+        else:
+            self.criterion = MultiTaskLoss(model.target_type, model.weights_loss)
+        self.optimizer = torch.optim.Adam(model.parameters(), lr = eta) # Define the optimizer
+        self.epochs = 0 # Number of epochs performed so far
+        self.augmentation = augmentation
+        if augmentation is not None:
+            # The augmentations are drawn from their own generator, seeded from the global one,
+            # so that the results do not depend on the scheduling of the background thread
+            self.generator = torch.Generator().manual_seed(int(torch.randint(2**62,(1,))))
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.next_input = None # Augmented input being prepared in the background
+
+    def train_epoch(self, epoch_input):
+        """
+        Goal:
+        Train the model for one epoch
+        Inputs:
+        epoch_input = tensor - size (Nx2x14x14) - input of the training datas for this epoch
+        Outputs:
+        """
+        model = self.model
+        criterion = self.criterion
+        mini_batch_size = self.mini_batch_size
+        train_target, train_classes = self.train_target, self.train_classes
+        for b in range(0, epoch_input.size(0), mini_batch_size):
+            with torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.bf16):
+                # Compute the output of the model
+                output = model(epoch_input.narrow(0, b, mini_batch_size))
+                # Weighted sum of the losses of each output (auxiliary losses)
+                loss = criterion(output, 
+                                 train_target.narrow(0, b, mini_batch_size), 
+                                 train_classes.narrow(0, b, mini_batch_size))
+            model.zero_grad() # Reset the gradient tensors to 0
+            loss.backward() # Perform a backward step
+            self.optimizer.step() # Update the weights
+
+    def prefetch(self):
+        """
+        Goal:
+        Start preparing the augmented input of the next epoch in the background (if it is not
+        already being prepared), it is kept until the next epoch is trained
+        Inputs:
+        Outputs:
+        """
+        if self.augmentation is not None and self.next_input is None:
+            self.next_input = self.executor.submit(self.augmentation,self.train_input,self.generator)
+
+    def advance(self, nb_epochs):
+        """
+        Goal:
+        Continue the training for nb_epochs epochs
+        Inputs:
+        nb_epochs = int - Number of epochs
+        Outputs:
+        """
+        for epoch in range(nb_epochs):
+            epoch_input = self.train_input
+            if self.augmentation is not None:
+                self.prefetch()
+                epoch_input = self.next_input.result()
+                self.next_input = None
+                if epoch + 1 < nb_epochs:
+                    # Prepare the input of the next epoch while this one is trained
+                    # (no augmentation is computed after the last epoch)
+                    self.prefetch()
+            self.train_epoch(epoch_input)
+            self.epochs += 1
+
+    def run(self, nb_epochs, callback=None, every=1):
+        """
+        Goal:
+        Continue the training for nb_epochs epochs, calling callback every "every" epochs
+        Inputs:
+        nb_epochs = int - Number of epochs
+        callback = function or None - called as callback(trainer) (e.g. to evaluate the model),
+                   self.epochs gives the number of epochs performed so far
+        every = int > 0 - interval between two calls of callback
+        Outputs:
+        """
+        for b in range(0, nb_epochs, every):
+            self.advance(min(every, nb_epochs - b))
+            if b + every < nb_epochs:
+                # Another epoch follows: prepare its input while the callback runs
+                self.prefetch()
+            if callback is not None:
+                callback(self)
+
+    def close(self):
+        """
+        Goal:
+        Stop the background thread of the augmentation (the pending input is dropped)
+        Inputs:
+        Outputs:
+        """
+        if self.augmentation is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.next_input = None
 
 
 def train_model(model, train_input, train_target, train_classes,
                 nb_epochs=50, 
                 mini_batch_size = 100, 
-                eta = 0.05):
+                eta = 0.05,
+                augmentation = None,
+                bf16 = False):
     """
     Goal:
-    Train a given model 
+    Train a given model (see Trainer to resume the training with the same optimizer)
     Inputs:
     model = nn.Module class object - model you want to train
     train_input = tensor - size (Nx2x14x14) (N number of samples)
@@ -28,46 +210,124 @@ def train_model(model, train_input, train_target, train_classes,
     nb_epochs = int - Number of epochs for the training
     mini_batch_size = int - size of the mini batch size
     eta = float - learning rate 
+    augmentation = function or None - see Trainer
+    bf16 = bool - bfloat16 autocast training (see Trainer)
     Outputs:
     """
-    criterion = nn.CrossEntropyLoss() # Define the loss
-    optimizer = torch.optim.Adam(model.parameters(), lr = eta) # Define the optimizer
-    # For each output of the model a target type is associated (auxiliary losses)
-    target_type = model.target_type 
-    # For each loss a weight is defined
-    weights_loss = model.weights_loss
-    for epochs in range(nb_epochs):
-        for b in range(0, train_input.size(0), mini_batch_size):
-            # Compute the output of the model
-            output = model(train_input.narrow(0, b, mini_batch_size))
-            # If there is multiple outputs (auxiliary losses)
-            if len(target_type) > 1:
-                loss_list = [] # List where the losses will be stored
-                for i,target in enumerate(target_type):
-                    # Target 0 means that the output predicts whether the first number 
-                    # is higher or lower than the second one
-                    if target == "target0":
-                        # Compute the auxiliary loss
-                        aux_loss = criterion(output[i], 
-                                                 train_target.narrow(0, b, mini_batch_size))
-                    # Target 1 means that the output predicts the classes of the images
-                    elif target == "target1":
-                        # Compute the auxiliary loss
-                        aux_loss = criterion(output[i], 
-                                                 train_classes.narrow(0, b, mini_batch_size))
-                    else:
-                        # print Error message
-                        return "Unexpected value in the attribute target_type"
-                    # Add the weighted auxiliary loss to the loss list
-                    loss_list.append(aux_loss*weights_loss[i])
-                # Sum the auxiliary losses
-                loss = sum(loss_list)
-            else:
-                # Else if one output : no auxiliary losses
-                loss = criterion(output, train_target.narrow(0, b, mini_batch_size))
-            model.zero_grad() # Reset the gradient tensors to 0
-            loss.backward() # Perform a backward step
-            optimizer.step() # Update the weights
+    trainer = Trainer(model, train_input, train_target, train_classes,
+                      mini_batch_size=mini_batch_size, eta=eta, augmentation=augmentation, bf16=bf16)
+    try:
+        trainer.advance(nb_epochs)
+    finally:
+        trainer.close()
+
+
+# Cross_validation instance used by the worker processes of Cross_validation.run_all
+worker_cross_validation = None
+
+def init_worker(cross_validation,threads):
+    """
+    Goal:
+    Initialize a worker process of Cross_validation.run_all
+    Inputs:
+    cross_validation = Cross_validation - instance whose jobs are run by the worker
+    threads = int - number of intra-op threads of the worker
+    Outputs:
+    """
+    global worker_cross_validation
+    worker_cross_validation = cross_validation
+    # The workers use threads_per_worker threads instead of the ones of the CPU profile
+    cross_validation.profile_threads = False
+    # Limit the number of threads so that the workers do not oversubscribe the CPU
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass # Already set
+
+def run_worker_job(index,run):
+    """
+    Goal:
+    Run one job (architecture, run) in a worker process (see Cross_validation.run_job)
+    Inputs:
+    index = int - index of the architecture
+    run = int - index of the run
+    Outputs:
+    Outputs of Cross_validation.run_job
+    """
+    return worker_cross_validation.run_job(index,run)
+
+
+class MetricsStore():
+
+    def __init__(self,columns,dtypes,capacity=0):
+        """
+        Goal:
+        Columnar store of results: one preallocated typed array per column, 
+        appending a row is O(1) (the capacity is doubled when full)
+        Inputs:
+        columns = list of strings - names of the columns
+        dtypes = list of numpy dtypes - type of each column
+        capacity = int - number of rows to preallocate
+        Outputs:
+        """
+        self.columns = columns
+        self.dtypes = dtypes
+        self.size = 0 # Number of rows stored
+        self.arrays = [np.empty(capacity,dtype=dtype) for dtype in dtypes]
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self,capacity):
+        """
+        Goal:
+        Make sure that capacity rows can be stored without reallocation
+        Inputs:
+        capacity = int - number of rows
+        Outputs:
+        """
+        if capacity > self.arrays[0].shape[0]:
+            for i, array in enumerate(self.arrays):
+                new_array = np.empty(capacity,dtype=array.dtype)
+                new_array[:self.size] = array[:self.size]
+                self.arrays[i] = new_array
+
+    def append(self,row):
+        """
+        Goal:
+        Append one row
+        Inputs:
+        row = list or tuple - one value per column
+        Outputs:
+        """
+        if self.size == self.arrays[0].shape[0]:
+            self.reserve(max(1,2*self.size))
+        for array, value in zip(self.arrays,row):
+            array[self.size] = value
+        self.size += 1
+
+    def to_dataframe(self):
+        """
+        Goal:
+        Export the stored rows as a pandas data frame, without copy
+        Inputs:
+        Outputs:
+        df = pandas DataFrame
+        """
+        data = {column: array[:self.size] for column, array in zip(self.columns,self.arrays)}
+        return pd.DataFrame(data,copy=False)
+
+    def to_arrow(self):
+        """
+        Goal:
+        Export the stored rows as a pyarrow table, without copy (requires pyarrow)
+        Inputs:
+        Outputs:
+        table = pyarrow Table
+        """
+        import pyarrow as pa
+        return pa.table({column: array[:self.size] for column, array in zip(self.columns,self.arrays)})
 
 
 class Cross_validation():
@@ -76,7 +336,9 @@ class Cross_validation():
                  architectures,
                  args,
                  steps=5,
-                 runs=10,load=5000,epochs=50):
+                 runs=10,load=5000,epochs=50,seed=0,cache_dir=None,resample_pairs=False,
+                 augmentation=False,eval_batch_size=1000,record_errors=True,cpu_profile=None,
+                 bf16=False):
         """
         Goal:
         Inputs:
@@ -86,6 +348,23 @@ class Cross_validation():
         runs = int - number of times to retrain a new model
         load = int - number of samples you are loading (only 1000 will be used for train and test at each run)
         epochs = int - number of epochs for the training
+        seed = int - seed from which the seed of each (architecture, run) job is derived,
+               so that the results do not depend on the order in which the jobs are run
+        cache_dir = string or None - directory where the preprocessed data set is cached 
+                    (see generate_pair_sets), None to disable the cache
+        resample_pairs = bool - draw new pairs of images at each run instead of 
+                         sampling among the "load" pairs drawn once
+        augmentation = bool - train on augmented data (see data_augmentation), 
+                       a new augmentation is drawn at each epoch
+        eval_batch_size = int - maximal number of samples evaluated at once (see evaluate)
+        record_errors = bool - record the misclassified test samples at the end of each run 
+                        (see get_errors)
+        cpu_profile = CPUProfile or None - memory format and number of threads used for the 
+                      training and the evaluation of each architecture (tuned here if they are
+                      not in the profile yet), None to use the default settings of torch
+        bf16 = bool - train with bfloat16 autocast (see Trainer), recorded in the "precision"
+               column (0 float32, 1 bfloat16) so that both modes can be compared after
+               changing the attribute bf16 (see precision_report)
         Outputs:
         """
         self.architectures = architectures # Get the list of architectures
@@ -93,25 +372,67 @@ class Cross_validation():
         self.archi_names = [archi.__name__ for archi in self.architectures]
         self.args = args # Get the arguments for each architecture
         self.runs = runs # Number of runs
+        self.seed = seed # Seed of the jobs
         # Columns of the data frame where all the data will be stored (will be used for the graphs)
-        self.columns = ["run_id","architecture","accuracy","type","epochs"]
-        # Create the data frames
-        self.columns_time = ["architecture","time","run_id"]
+        self.columns = ["run_id","architecture","accuracy","type","epochs","precision"]
+        self.dtypes = [np.int64,np.int64,np.float64,np.int64,np.int64,np.int64]
+        # Create the stores (exported as data frames, see dataframe and datatime)
+        self.columns_time = ["architecture","time","run_id","precision"]
+        self.dtypes_time = [np.int64,np.float64,np.int64,np.int64]
         self.parameters_count = self.count_params()
-        self.datatime = pd.DataFrame([[1e20,1e20,1e20]],columns=self.columns_time)
-        self.dataframe = pd.DataFrame([[1e20,1e20,1e20,1e20,1e20]],columns=self.columns)
-        # Load the the data set
-        data = generate_pair_sets(load)
+        # Load the the data set as lazy views: only the pairs used by a run are gathered
+        self.train_set, self.test_set = generate_pair_sets(load,cache_dir=cache_dir,lazy=True)
+        self.resample_pairs = resample_pairs
+        self.augmentation = augmentation
+        self.bf16 = bf16
         self.size = 1000 # Number of samples used for training and testing at each run
         self.epochs = epochs # get the number of epochs
-        # To be checked (are these two lines necessary ??)
-        self.train_input, self.train_target, self.train_classes = data[0], data[1], data[2]
-        self.test_input, self.test_target, self.test_classes = data[3], data[4], data[5]
         self.steps = steps # Get Granularity for the graphs
+        self.reset()
         # Row format for the logs
         self.row_format = '{:<20}{:<15}{:<25}{:<25}{:<15}' # Define the display format
-        #store it to see plot where the model fail, random initialisation
-        self.img_errors = torch.empty(2,3)
+        self.eval_batch_size = eval_batch_size # Maximal size of the chunks used for evaluation
+        self.record_errors = record_errors
+        # Misclassified samples (see get_errors), random initialisation
+        self.errors_input = torch.empty(0,2,14,14)
+        self.errors_index = torch.empty(0,dtype=torch.long)
+        self.cpu_profile = cpu_profile
+        # Use the numbers of threads of the profile (disabled in the worker processes of run_all,
+        # which use threads_per_worker)
+        self.profile_threads = True
+        if cpu_profile is not None:
+            for i,archi in enumerate(self.architectures):
+                self.profile_configs(i)
+
+    def profile_configs(self,index):
+        """
+        Goal:
+        Return the configurations of the CPU profile for the training and the evaluation of an
+        architecture (see CPUProfile.config)
+        Inputs:
+        index = int - index of the architecture
+        Outputs:
+        train_config = dict - configuration of the training (mini batches of 100 samples)
+        eval_config = dict - configuration of the evaluation
+        """
+        Myclass, args = self.architectures[index], self.args[index]
+        # The models are fed with the pairs of images
+        channels = self.train_set[:1][0].shape[1]
+        train_config = self.cpu_profile.config(Myclass,args,100,channels=channels)
+        eval_config = self.cpu_profile.config(Myclass,args,min(self.eval_batch_size,self.size),
+                                              channels=channels,training=False)
+        return train_config, eval_config
+
+    def set_threads(self,config):
+        """
+        Goal:
+        Use the number of threads of a configuration of the CPU profile (if any)
+        Inputs:
+        config = dict or None
+        Outputs:
+        """
+        if config is not None and self.profile_threads:
+            self.cpu_profile.set_threads(config)
 
     def count_params(self):
         """
@@ -132,18 +453,14 @@ class Cross_validation():
             param_count.append(n_params)
         return param_count
 
-    def data_augmentation(self,train_input):
+    def data_augmentation(self,train_input,generator=None):
         """
-        Augment the data by :Random tilt between [-30,30] degree and RandomErasing 
+        Augment the data by : Random tilt between [-20,20] degree and random erasing, 
+        drawn independently for every image (see augment)
         p – probability that the random erasing operation will be performed.
-        scale – range of proportion of erased area against input image.
-        ratio – range of aspect ratio of erased area.
+        scale – proportion of erased area against input image.
         """
-        rotation=transform.RandomRotation((-20,20))
-        erasing=transform.RandomErasing(p=0.3, scale=(0.025, 0.025), ratio=(1, 1))
-        tilted_train=rotation(train_input)
-        train_input_augmented=erasing(tilted_train)
-        return train_input_augmented
+        return augment(train_input,degrees=20,p=0.3,scale=0.025,generator=generator)
 
     def split_data(self,nb_classes=10):
         """
@@ -165,53 +482,186 @@ class Cross_validation():
         test_classes = tensor - size (1000x2)
                         Classes (i.e. numbers) of the two images - belongs to {1,...,10}
         """
-        
-        shuffle = torch.randperm(self.train_input.shape[0])
-        index = shuffle[:self.size]
-        train_input = self.train_input[index]
-        train_target = self.train_target[index]
-        train_classes = self.train_classes[index]
-        test_input = self.test_input[index]
-        test_target = self.test_target[index]
-        test_classes = self.test_classes[index]
+        if self.resample_pairs:
+            # New pairs of images
+            train_set = self.train_set.resample(self.size)
+            test_set = self.test_set.resample(self.size)
+        else:
+            shuffle = torch.randperm(len(self.train_set))
+            index = shuffle[:self.size]
+            train_set = self.train_set.subset(index)
+            test_set = self.test_set.subset(index)
+        # Gather the pairs
+        train_input, train_target, train_classes = train_set[:]
+        test_input, test_target, test_classes = test_set[:]
         return train_input, train_target, train_classes ,test_input ,test_target ,test_classes
 
-    def accuracy(self,model,input,target):
+    def evaluate(self,model,data_sets,record_errors=False):
         """
         Goal:
-        Compute the accuracy of a model on a given data set
+        Compute the accuracy of a model on several data sets in one pass: the model is put in
+        eval mode once and run under torch.inference_mode on chunks of at most
+        self.eval_batch_size samples, so that the memory used does not grow with the data sets
+        Inputs:
+        data_sets = list of tuples (input,target)
+                    input = tensor - size (Nx2x14x14) N number of samples
+                    target = tensor - size (N) - targets - belongs to {0,1}
+        record_errors = bool - store the indices of the misclassified samples of the last 
+                        data set (see get_errors)
+        Outputs:
+        accuracies = list of float - Accuracy in percentage on each data set
+        """
+        training = model.training
+        model.eval()
+        errors = [] # Number of errors on each data set (kept as tensors until the end)
+        with torch.inference_mode(): # Shut down the autograd machinery
+            for k,(input,target) in enumerate(data_sets):
+                record = record_errors and k == len(data_sets) - 1
+                nb_errors = torch.zeros((),dtype=torch.long)
+                errors_index = []
+                for b in range(0, input.size(0), self.eval_batch_size):
+                    output = model(input[b:b + self.eval_batch_size]) # Compute the output of the model
+                    # If the model has auxiliary output
+                    if len(model.target_type) > 1: 
+                        # Let's take the real one (by convention the first returned)
+                        output = output[0] 
+                    # Compare the prediction with the target
+                    wrong = output.argmax(dim=1) != target[b:b + self.eval_batch_size]
+                    nb_errors += wrong.sum()
+                    if record:
+                        errors_index.append(wrong.nonzero(as_tuple=True)[0] + b)
+                errors.append(nb_errors)
+                if record:
+                    # Only the indices are stored, the images are gathered by get_errors
+                    self.errors_index = torch.cat(errors_index)
+                    self.errors_input = input
+        model.train(training)
+        # Compute the accuracies
+        return [(1 - e.item()/input.shape[0])*100 for e,(input,_) in zip(errors,data_sets)]
+
+    def accuracy(self,model,input,target,record_errors=False):
+        """
+        Goal:
+        Compute the accuracy of a model on a given data set (see evaluate)
         Inputs:
         input = tensor - size (Nx2x14x14) N number of samples
                 input of the model
         target = tensor - size (N) N number of samples
                  targets - belongs to {0,1}
+        record_errors = bool - store the indices of the misclassified samples (see get_errors)
         Outputs:
         accuracy = float - Accuracy in percentage 
         """
-        model.eval()
-        with torch.no_grad(): # Shut down the autograd machinery
-            output = model(input) # Compute the output of the model
-            # If the model has auxiliary output
-            if len(model.target_type) > 1: 
-                 # Let's take the real one (by convention the first returned)
-                main_output = output[0] 
-            else:
-                main_output=output
-            _,predicted = torch.max(main_output,dim=1) # Compute the prediction
-            #compute the error matrix
-            errors_matrix=torch.where(target != predicted,1,0)
-            # Compute the number of errors
-            errors = errors_matrix.sum().item()
-            #store the wrong set of image
-            errors_index=((errors_matrix == 1).nonzero(as_tuple=True)[0])
-            self.img_errors=input[errors_index]
-            # Compute the accuracy
-            accuracy = (1 - errors/(target.shape[0]))*100
-        model.train()
-        return accuracy
+        return self.evaluate(model,[(input,target)],record_errors=record_errors)[0]
 
     def get_errors(self):
-        return self.img_errors
+        """
+        Goal:
+        Return the misclassified samples of the last evaluation where they were recorded
+        (by default the test set at the end of the last run performed in this process)
+        Inputs:
+        Outputs:
+        img_errors = tensor - size (Ex2x14x14) E number of errors
+        """
+        return self.errors_input[self.errors_index]
+
+    def job_seed(self,index,run):
+        """
+        Goal:
+        Return the seed of the job (architecture, run)
+        Inputs:
+        index = int - index of the architecture
+        run = int - index of the run
+        Outputs:
+        seed = int
+        """
+        return (self.seed*len(self.architectures) + index)*self.runs + run
+
+    def run_job(self,index,run):
+        """
+        Goal:
+        Train one model generated by the architecture number "index" and record its performances
+        each "self.steps" epochs. The job is seeded with job_seed so that it gives the same 
+        results whether it is run serially or in a worker process
+        Inputs:
+        index = int - index of the architecture
+        run = int - index of the run
+        Outputs:
+        new_data = list of tuples - rows to add to the data frame
+        row_time = tuple - row to add to the time data frame
+        row = list - row to be displayed/logged
+        """
+        torch.manual_seed(self.job_seed(index,run))
+        # Get the class and the arguments
+        Myclass = self.architectures[index]
+        args = self.args[index]
+        # Get a random data set of 1000 samples for training, same for testing 
+        data = self.split_data() 
+        # Extract this
+        train_input, train_target, train_classes = data[0], data[1], data[2]
+        test_input, test_target, _ = data[3], data[4], data[5]
+        # Create the model
+        model = Myclass(*args)
+        train_config = eval_config = None
+        previous_threads = torch.get_num_threads()
+        if self.cpu_profile is not None:
+            # The memory format of the training is also used for the evaluation
+            train_config, eval_config = self.profile_configs(index)
+            model = self.cpu_profile.convert(model,train_config)
+            train_input = self.cpu_profile.convert(train_input,train_config)
+            test_input = self.cpu_profile.convert(test_input,train_config)
+        data_sets = [(train_input,train_target),(test_input,test_target)]
+        nb_epochs = self.steps*len(range(self.steps,self.epochs,self.steps))
+        def evaluate_all(record_errors):
+            self.set_threads(eval_config)
+            accuracies = self.evaluate(model,data_sets,record_errors=self.record_errors and record_errors)
+            self.set_threads(train_config)
+            return accuracies
+        # Compute the initial accuracy 
+        accuracy_train, accuracy_test = evaluate_all(nb_epochs == 0)
+        # Store it into the new_data list
+        precision = int(self.bf16)
+        new_data = [(run,index,accuracy_train,0,0,precision),(run,index,accuracy_test,1,0,precision)]
+        accuracies = [accuracy_train,accuracy_test]
+        def evaluate(trainer):
+            # Compute the accuracy on the train and test set
+            # (the errors are only recorded at the end of the training)
+            accuracies[:] = evaluate_all(trainer.epochs == nb_epochs)
+            # Store is into the new_data list
+            new_data.append((run,index,accuracies[0],0,trainer.epochs,precision))
+            new_data.append((run,index,accuracies[1],1,trainer.epochs,precision))
+        # Train the model continuously and record the accuracy each self.steps epochs
+        trainer = Trainer(model,train_input,train_target,train_classes,
+                          augmentation=self.data_augmentation if self.augmentation else None,
+                          bf16=self.bf16)
+        try:
+            start = perf_counter() # Start the chrono
+            trainer.run(nb_epochs,callback=evaluate,every=self.steps)
+            end = perf_counter() # Stop the chrono
+        finally:
+            trainer.close()
+            torch.set_num_threads(previous_threads)
+        accuracy_train, accuracy_test = accuracies
+        elapsed = (end - start)/self.steps # Compute the elapsed time
+        row_time = (index,elapsed,run,precision)
+        # Row to be displayed/logged
+        row = [self.archi_names[index],run,
+               round(accuracy_train,1),
+               round(accuracy_test,1),round(elapsed,1)]
+        return new_data, row_time, row
+
+    def store(self,results):
+        """
+        Goal:
+        Add the results of jobs to the data frames
+        Inputs:
+        results = list of outputs of run_job
+        Outputs:
+        """
+        for new_data, row_time, _ in results:
+            for row in new_data:
+                self.metrics.append(row)
+            self.times.append(row_time)
 
     def run_one(self,archi_name):
         """
@@ -228,67 +678,46 @@ class Cross_validation():
             return "Unexpected value for archi_name"
         # Get the index of the architecture
         index = self.archi_names.index(archi_name)
-        # Get the class 
-        Myclass = self.architectures[index]
-        # Get the arguments
-        args = self.args[index]
-        # The data to add to the data frame will be stored in this tensor
-        new_data_time = torch.zeros(len(self.columns_time)).view(1,-1)
-        new_data = torch.zeros(len(self.columns)).view(1,-1)
-        for runs in range(self.runs): # Repeat runs times
-            # Get a random data set of 1000 samples for training, same for testing 
-            data = self.split_data() 
-            # Extract this
-            train_input, train_target, train_classes = data[0], data[1], data[2]
-            test_input, test_target, _ = data[3], data[4], data[5]
-            # Create the model
-            model = Myclass(*args)
-            # Compute the initial accuracy 
-            accuracy_train = self.accuracy(model,train_input,train_target)
-            accuracy_test = self.accuracy(model,test_input,test_target)
-            # Store it into the new_data tensor
-            row_test = torch.tensor([runs,index,accuracy_test,1,0]).view(1,-1)
-            row_train = torch.tensor([runs,index,accuracy_train,0,0]).view(1,-1)
-            new_data = torch.cat((new_data,row_train,row_test),dim=0)
-            # Train the model and record the accuracy each self.steps epochs
-            start = perf_counter() # Start the chrono
-            for step in range(self.steps,self.epochs,self.steps):
-                # Train the model for self.steps epochs
-                train_model(model, 
-                            train_input, 
-                            train_target, 
-                            train_classes, 
-                            nb_epochs=self.steps)
-                # Compute the accuracy on the train and test set
-                accuracy_train = self.accuracy(model,train_input,train_target)
-                accuracy_test = self.accuracy(model,test_input,test_target)
-                # Store is into the new_data tensor
-                row_test = torch.tensor([runs,index,accuracy_test,1,step]).view(1,-1)
-                row_train = torch.tensor([runs,index,accuracy_train,0,step]).view(1,-1)
-                new_data = torch.cat((new_data,row_train,row_test),dim=0)
-            # Store into the new_data_time tensor
-            end = perf_counter() # Stop the chrono
-            elapsed = (end - start)/self.steps # Compute the elapsed time
-            row_time = torch.tensor([index,elapsed,runs]).view(1,-1)
-            new_data_time = torch.cat((new_data_time,row_time),dim=0)
-            # Row to be displayed/logged
-            row = [archi_name,runs,
-                   round(accuracy_train,1),
-                   round(accuracy_test,1),round(elapsed,1)]
+        results = []
+        for run in range(self.runs): # Repeat runs times
+            results.append(self.run_job(index,run))
             # Print a message about the performances of the architecture
-            print(self.row_format.format(*row))
-        # Remove the first artificial line
-        new_data = new_data[1:]
-        new_data_time = new_data_time[1:]
-        # Add the new data to the existing data frame
-        df = pd.DataFrame(data=new_data.tolist(),columns=self.columns)
-        self.dataframe = self.dataframe.append(df,ignore_index=True)
-        # Remove the first artificial line of the data frame
-        df_time = pd.DataFrame(data=new_data_time.tolist(),columns=self.columns_time)
-        self.datatime = self.datatime.append(df_time,ignore_index=True)
-        self.remove_line()
+            print(self.row_format.format(*results[-1][2]))
+        self.store(results)
+
+    def profile(self,archi_name,nb_epochs=1,trace_path=None):
+        """
+        Goal:
+        Profile each layer of a model generated by the architecture "archi_name" during
+        nb_epochs epochs of training and one evaluation (see LayerProfiler)
+        Inputs:
+        archi_name = name of the architecture (i.e. name of the class)
+        nb_epochs = int - number of profiled training epochs
+        trace_path = string or None - JSON file where the Chrome trace is written
+        Outputs:
+        table = pandas DataFrame - per layer and phase time, FLOPs and bytes (see LayerProfiler.table)
+        """
+        # Check that the name of the architectures is defined
+        if not archi_name in self.archi_names:
+            return "Unexpected value for archi_name"
+        # Get the index of the architecture
+        index = self.archi_names.index(archi_name)
+        model = self.architectures[index](*self.args[index])
+        data = self.split_data()
+        trainer = Trainer(model,data[0],data[1],data[2],
+                          augmentation=self.data_augmentation if self.augmentation else None,
+                          bf16=self.bf16)
+        try:
+            with LayerProfiler(model) as profiler:
+                trainer.advance(nb_epochs)
+                self.evaluate(model,[(data[3],data[4])])
+        finally:
+            trainer.close()
+        if trace_path is not None:
+            profiler.export_chrome_trace(trace_path)
+        return profiler.table()
 
-    def run_all(self):
+    def run_all(self,nb_workers=None,threads_per_worker=1):
         """
         Goal:
         For each architecture : 
@@ -296,6 +725,10 @@ class Cross_validation():
         Store the performances of these models in the data frame
         the performances are recorded each "self.step" epochs
         Inputs:
+        nb_workers = int or None - number of worker processes running the (architecture, run) 
+                     jobs in parallel, None to run them serially. The data frames are
+                     identical in both cases (except for the measured times)
+        threads_per_worker = int - number of intra-op threads of each worker process
         Outputs:
         """
         # Header to be displayed
@@ -303,20 +736,46 @@ class Cross_validation():
         under_header = ["-"*len(word) for word in header]
         print(self.row_format.format(*header)) # Print the header
         print(self.row_format.format(*under_header)) # Print the the under_header
-        # For each architecture
-        for archi_name in self.archi_names:
-            self.run_one(archi_name)
+        if nb_workers is None:
+            # For each architecture
+            for archi_name in self.archi_names:
+                self.run_one(archi_name)
+            return
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=nb_workers,mp_context=context,
+                                 initializer=init_worker,initargs=(self,threads_per_worker)) as executor:
+            # Submit all the jobs at once
+            futures = [[executor.submit(run_worker_job,index,run) for run in range(self.runs)]
+                       for index in range(len(self.architectures))]
+            # Merge the results in the same order as the serial path
+            for index_futures in futures:
+                results = []
+                for future in index_futures:
+                    results.append(future.result())
+                    print(self.row_format.format(*results[-1][2]))
+                self.store(results)
+
+    @property
+    def dataframe(self):
+        """
+        Goal:
+        Return the accuracies as a data frame (view on the columns of self.metrics)
+        Inputs:
+        Outputs:
+        df = pandas DataFrame - columns self.columns
+        """
+        return self.metrics.to_dataframe()
 
-    def remove_line(self):
+    @property
+    def datatime(self):
         """
         Goal:
-        Remove the artficial first line of the data frame
+        Return the training times as a data frame (view on the columns of self.times)
         Inputs:
         Outputs:
+        df = pandas DataFrame - columns self.columns_time
         """
-        # Remove the first line where accuracy was set to 1e20
-        self.dataframe = self.dataframe.query("accuracy < 1e3")
-        self.datatime = self.datatime.query("time < 1e10")
+        return self.times.to_dataframe()
 
     def reset(self):
         """
@@ -325,10 +784,37 @@ class Cross_validation():
         Inputs:
         Outputs:
         """
-        # Reset the data frame
-        self.dataframe = pd.DataFrame([[1e20,1e20,1e20,1e20,1e20]],columns=self.columns)
-        self.datatime = pd.DataFrame([[1e20,1e20,1e20]],columns=self.columns_time)
+        # Preallocate the stores for one call of run_all
+        nb_points = 1 + len(range(self.steps,self.epochs,self.steps)) # Evaluations per run
+        nb_runs = len(self.architectures)*self.runs
+        self.metrics = MetricsStore(self.columns,self.dtypes,capacity=2*nb_points*nb_runs)
+        self.times = MetricsStore(self.columns_time,self.dtypes_time,capacity=nb_runs)
     
+    def precision_report(self):
+        """
+        Goal:
+        Compare the bfloat16 and the float32 trainings of each architecture: mean final test 
+        accuracy and mean training time of each precision, accuracy difference and speedup
+        (both precisions must have been run, see the attribute bf16)
+        Inputs:
+        Outputs:
+        report = pandas DataFrame - one row per architecture
+        """
+        df = self.dataframe
+        final = df[(df["type"] == 1) & (df["epochs"] == df["epochs"].max())]
+        accuracy = final.pivot_table(index="architecture",columns="precision",values="accuracy")
+        time = self.datatime.pivot_table(index="architecture",columns="precision",values="time")
+        # Missing precisions give NaN columns
+        accuracy, time = accuracy.reindex(columns=[0,1]), time.reindex(index=accuracy.index,columns=[0,1])
+        report = pd.DataFrame({"architecture": [self.archi_names[i] for i in accuracy.index],
+                               "accuracy_fp32": accuracy[0],
+                               "accuracy_bf16": accuracy[1],
+                               "time_fp32": time[0],
+                               "time_bf16": time[1]})
+        report["accuracy_delta"] = report["accuracy_bf16"] - report["accuracy_fp32"]
+        report["speedup"] = report["time_fp32"]/report["time_bf16"]
+        return report.reset_index(drop=True)
+
     def plot_std(self,figure,subplot):
         """
         Goal:
@@ -355,7 +841,7 @@ class Cross_validation():
         # Get the lines and labels of the graphs
         handles, labels = ax.get_legend_handles_labels()
         # Replace number by real labels
-        labels = ["test"*(label == '1.0') + "train"*(label == '0.0') for label in labels]
+        labels = ["test"*(float(label) == 1) + "train"*(float(label) == 0) for label in labels]
         # Display label information
         ax.legend(handles,labels,fontsize=13)
         ax.set_title(title,fontsize=13)
@@ -389,7 +875,7 @@ class Cross_validation():
         sns.lineplot(data=archi_data,x="epochs",y="accuracy",hue="type",ax=ax,ci=90)
         handles, labels = ax.get_legend_handles_labels() # Get lines and labels
         # Replace number by real labels
-        labels = ["test"*(label == '1.0') + "train"*(label == '0.0') for label in labels]
+        labels = ["test"*(float(label) == 1) + "train"*(float(label) == 0) for label in labels]
         # Display label information
         ax.set_title(title,fontsize=13)
         ax.set_xlabel("Epochs",fontsize=13)
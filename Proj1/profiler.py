@@ -0,0 +1,201 @@
+import json
+import torch
+import torch.nn as nn
+import pandas as pd
+from time import perf_counter
+
+
+def layer_flops(module,output):
+    """
+    Goal:
+    Number of floating point operations of one call of a layer (a multiply-add counts as 2)
+    Inputs:
+    module = nn.Module - leaf module
+    output = tensor - output of the call (or gradient with respect to it)
+    Outputs:
+    flops = int
+    """
+    if isinstance(module,nn.Conv2d):
+        kernel = module.in_channels//module.groups*module.kernel_size[0]*module.kernel_size[1]
+        return 2*output.numel()*kernel
+    if isinstance(module,nn.Linear):
+        return 2*output.numel()*module.in_features
+    if isinstance(module,(nn.BatchNorm1d,nn.BatchNorm2d)):
+        return 2*output.numel()
+    if isinstance(module,nn.MaxPool2d):
+        # One comparison per element of each pooling window
+        kernel = module.kernel_size
+        kernel = kernel[0]*kernel[1] if isinstance(kernel,tuple) else kernel*kernel
+        return output.numel()*kernel
+    if isinstance(module,(nn.ReLU,nn.Dropout,nn.Tanh)):
+        return output.numel()
+    return 0
+
+
+def first_tensor(x):
+    if isinstance(x,(tuple,list)):
+        for item in x:
+            if isinstance(item,torch.Tensor):
+                return item
+        return None
+    return x
+
+
+class LayerProfiler():
+
+    def __init__(self,model):
+        """
+        Goal:
+        Per-layer profiler of a model: while it is enabled, forward and backward hooks on every
+        leaf module record one event per call (time, FLOPs, activation and parameter bytes).
+        No hook is registered while it is disabled, so the model runs at full speed.
+        Usage:
+        with LayerProfiler(model) as profiler:
+            ... (training or inference)
+        profiler.table()
+        Inputs:
+        model = nn.Module
+        Outputs:
+        """
+        self.model = model
+        # Leaf modules with their qualified names (a module shared by several parents,
+        # or called several times, records one event per call). The loss of the model
+        # (criterion attribute, see MultiTaskLoss) is not a layer
+        criterion = getattr(model,"criterion",None)
+        excluded = list(criterion.modules()) if isinstance(criterion,nn.Module) else []
+        self.layers = {}
+        for name,module in model.named_modules():
+            if any(module is other for other in excluded):
+                continue
+            if len(list(module.children())) == 0 and module not in self.layers:
+                self.layers[module] = name
+        self.handles = [] # Hooks registered while enabled
+        self.starts = {} # Start time of the running calls, for each (module, phase)
+        self.events = []
+        self.origin = perf_counter()
+
+    def enable(self):
+        """
+        Goal:
+        Register the hooks
+        Inputs:
+        Outputs:
+        """
+        if self.handles:
+            return
+        for module in self.layers:
+            self.handles += [module.register_forward_pre_hook(self.forward_start),
+                             module.register_forward_hook(self.forward_end)]
+            # (for a layer whose input does not require a gradient, e.g. the first one, the
+            # backward hook fires before the gradients of the weights are computed)
+            self.handles += [module.register_full_backward_pre_hook(self.backward_start),
+                             module.register_full_backward_hook(self.backward_end)]
+
+    def disable(self):
+        """
+        Goal:
+        Remove the hooks
+        Inputs:
+        Outputs:
+        """
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.starts = {}
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self,*exc):
+        self.disable()
+
+    def reset(self):
+        """
+        Goal:
+        Erase the recorded events
+        Inputs:
+        Outputs:
+        """
+        self.events = []
+        self.origin = perf_counter()
+
+    def forward_start(self,module,input):
+        self.starts[(module,"forward")] = perf_counter()
+
+    def forward_end(self,module,input,output):
+        end = perf_counter()
+        output = first_tensor(output)
+        if output is None:
+            self.record(module,"forward",end,0,0)
+            return
+        self.record(module,"forward",end,layer_flops(module,output),output.numel()*output.element_size())
+
+    def backward_start(self,module,grad_output):
+        self.starts[(module,"backward")] = perf_counter()
+
+    def backward_end(self,module,grad_input,grad_output):
+        end = perf_counter()
+        grad_output = first_tensor(grad_output)
+        # The backward of a layer costs about twice its forward (gradients of input and weights)
+        flops = 0 if grad_output is None else 2*layer_flops(module,grad_output)
+        # (grad_input is None when the input of the layer does not require a gradient)
+        grad_input = first_tensor(grad_input)
+        self.record(module,"backward",end,flops,
+                    0 if grad_input is None else grad_input.numel()*grad_input.element_size())
+
+    def record(self,module,phase,end,flops,activation_bytes):
+        start = self.starts.pop((module,phase),end)
+        self.events.append((self.layers[module],type(module).__name__,phase,
+                            start - self.origin,end - start,flops,activation_bytes,
+                            sum(p.numel()*p.element_size() for p in module.parameters(recurse=False))))
+
+    def events_dataframe(self):
+        """
+        Goal:
+        Return the recorded events
+        Inputs:
+        Outputs:
+        df = pandas DataFrame - one row per call of a layer: columns layer, module, phase,
+             start [s], time [s], flops, activation_bytes, parameter_bytes
+        """
+        columns = ["layer","module","phase","start","time","flops","activation_bytes","parameter_bytes"]
+        return pd.DataFrame(self.events,columns=columns)
+
+    def table(self):
+        """
+        Goal:
+        Summarize the recorded events per layer and phase
+        Inputs:
+        Outputs:
+        df = pandas DataFrame - columns layer, module, phase, calls, time [s], share of the
+             total time, flops, GFLOP/s, activation_bytes, parameter_bytes - sorted by time
+        """
+        events = self.events_dataframe()
+        df = events.groupby(["layer","module","phase"],sort=False).agg(
+            calls=("time","size"),
+            time=("time","sum"),
+            flops=("flops","sum"),
+            activation_bytes=("activation_bytes","sum"),
+            parameter_bytes=("parameter_bytes","max")).reset_index()
+        df.insert(5,"share",df["time"]/df["time"].sum())
+        df.insert(7,"gflops",df["flops"]/df["time"]/1e9)
+        return df.sort_values("time",ascending=False).reset_index(drop=True)
+
+    def export_chrome_trace(self,path):
+        """
+        Goal:
+        Write the recorded events as a Chrome trace (chrome://tracing or Perfetto)
+        Inputs:
+        path = string - JSON file
+        Outputs:
+        """
+        trace = []
+        for layer,module,phase,start,time,flops,activation_bytes,parameter_bytes in self.events:
+            trace.append({"name": layer, "cat": module, "ph": "X", "pid": 0,
+                          "tid": 0 if phase == "forward" else 1,
+                          "ts": start*1e6, "dur": time*1e6,
+                          "args": {"phase": phase, "flops": flops, "activation_bytes": activation_bytes,
+                                   "parameter_bytes": parameter_bytes}})
+        with open(path,"w") as file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"},file)
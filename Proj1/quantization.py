@@ -0,0 +1,82 @@
+import torch
+from torch.ao.quantization import QConfigMapping, get_default_qconfig
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from architecture import *
+from inference import fold_batchnorm, latency
+
+
+def quantize(model,calibration_input,engine="x86",batch_size=500):
+    """
+    Goal:
+    Post-training int8 quantization of a model: the BatchNorms are folded (see fold_batchnorm),
+    the model is traced with torch.fx, observers are inserted (per-channel symmetric weights,
+    histogram activations) and fed with the calibration data, then the model is converted.
+    The two digits of siamese models (fold_siamese attribute) are folded into the batch so that
+    the shared trunk has a single call site, and thus a single set of observers for both digits
+    Inputs:
+    model = nn.Module - trained float model
+    calibration_input = tensor - size (Nx2x14x14) - held-out samples used to calibrate the
+                        activation observers
+    engine = string - quantized engine (see torch.backends.quantized.supported_engines)
+    batch_size = int - size of the calibration batches
+    Outputs:
+    quantized = torch.fx.GraphModule - int8 model, for inference only
+    """
+    torch.backends.quantized.engine = engine
+    folded = fold_batchnorm(model)
+    if hasattr(folded,"fold_siamese"):
+        folded.fold_siamese = True
+    qconfig_mapping = QConfigMapping().set_global(get_default_qconfig(engine))
+    prepared = prepare_fx(folded,qconfig_mapping,example_inputs=(calibration_input[:1],))
+    with torch.no_grad():
+        for b in range(0, calibration_input.size(0), batch_size):
+            prepared(calibration_input[b:b + batch_size])
+    return convert_fx(prepared)
+
+
+def accuracy(model,input,target,batch_size=1000):
+    """
+    Goal:
+    Accuracy of a model on the comparison target (first output if several)
+    Inputs:
+    input = tensor - size (Nx2x14x14)
+    target = tensor - size (N) - belongs to {0,1}
+    batch_size = int - size of the evaluated chunks
+    Outputs:
+    accuracy = float - Accuracy in percentage
+    """
+    errors = 0
+    with torch.inference_mode():
+        for b in range(0, input.size(0), batch_size):
+            output = model(input[b:b + batch_size])
+            if isinstance(output,tuple):
+                output = output[0]
+            errors += (output.argmax(dim=1) != target[b:b + batch_size]).sum().item()
+    return (1 - errors/input.size(0))*100
+
+
+if __name__ == "__main__":
+    from dlc_practical_prologue import generate_pair_sets
+    from metrics import train_model
+    torch.manual_seed(0)
+    nb_calibration = 200 # Training pairs held out for the calibration
+    train_input, train_target, train_classes, test_input, test_target, _ = generate_pair_sets(1000)
+    calibration_input = train_input[-nb_calibration:]
+    train_input, train_target, train_classes = (train_input[:-nb_calibration],
+                                                train_target[:-nb_calibration],
+                                                train_classes[:-nb_calibration])
+    row_format = '{:<20}{:<15}{:<15}{:<20}{:<20}{:<10}'
+    print(row_format.format("Architecture","Accuracy fp32","Accuracy int8",
+                            "fp32 (samples/s)","int8 (samples/s)","Speedup"))
+    for Myclass in [Naive_net,CrossArchitecture,oO_Net]:
+        model = Myclass()
+        train_model(model,train_input,train_target,train_classes,nb_epochs=25)
+        model.eval()
+        quantized = quantize(model,calibration_input)
+        accuracy_float = accuracy(model,test_input,test_target)
+        accuracy_int8 = accuracy(quantized,test_input,test_target)
+        throughput_float = test_input.size(0)/latency(model,test_input,repeats=10)
+        throughput_int8 = test_input.size(0)/latency(quantized,test_input,repeats=10)
+        print(row_format.format(Myclass.__name__,round(accuracy_float,1),round(accuracy_int8,1),
+                                round(throughput_float),round(throughput_int8),
+                                round(throughput_int8/throughput_float,2)))
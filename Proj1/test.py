@@ -0,0 +1,45 @@
+import torch
+from architecture import *
+from inference import fold_batchnorm, compile_for_inference, randomize_batchnorm
+
+
+# Architectures with the number of channels of their input
+ARCHITECTURES = [(Naive_net,2),(MnistCNN,1),(MnistResNet,1),(Simple_Net,1),
+                 (CrossArchitecture,2),(oO_Net,2)]
+
+
+def assert_outputs_close(output,reference,name):
+    """
+    Goal:
+    Check that two outputs (tensors or tuples of tensors) are equal up to 1e-6
+    """
+    if isinstance(output,torch.Tensor):
+        output, reference = (output,), (reference,)
+    assert len(output) == len(reference), name
+    for o,r in zip(output,reference):
+        torch.testing.assert_close(o,r,atol=1e-6,rtol=1e-5,msg=lambda message: name + ": " + message)
+
+
+def test_inference_parity():
+    """
+    Goal:
+    The BatchNorm-folded model and the frozen TorchScript model of every architecture give the
+    same outputs as the eval-mode model (see inference.py), for batch sizes 1, 64 and 1024
+    """
+    torch.manual_seed(0)
+    for Myclass,channels in ARCHITECTURES:
+        model = randomize_batchnorm(Myclass()).eval()
+        folded = fold_batchnorm(model)
+        compiled = compile_for_inference(model,torch.rand(2,channels,14,14))
+        for batch_size in [1,64,1024]:
+            input = torch.rand(batch_size,channels,14,14)
+            with torch.no_grad():
+                reference = model(input)
+                name = "{} (batch size {:d})".format(Myclass.__name__,batch_size)
+                assert_outputs_close(folded(input),reference,name + " folded")
+                assert_outputs_close(compiled(input),reference,name + " compiled")
+
+
+if __name__ == "__main__":
+    test_inference_parity()
+    print("Inference parity: OK")
@@ -0,0 +1,225 @@
+from Linear import *
+import torch
+import math
+
+
+class BatchedLinear():
+    
+    def __init__(self,nb_models,in_size,out_size,add_bias=True,generators=None):
+        """
+        Goal:
+        K independent linear layers stored as 3-D tensors, the forward and backward steps of 
+        all the members are computed with batched matrix products.
+        Same semantics as Linear for each member
+        Inputs:
+        nb_models = int > 0 - Number of members K
+        in_size = int > 0 - Input size of the layer
+        out_size = int > 0 - Output size of the layer
+        add_bias = bool - Specify if you want to add a bias or not
+        generators = list of K torch Generators or None - used to initialize each member
+        Outputs:
+        """
+        self.nb_models = nb_models
+        self.generators = generators
+        # Initialize the weights with Xavier Initialisation and the gradients to 0
+        self.weights = empty(nb_models,out_size,in_size)
+        self.grdweights = empty(nb_models,out_size,in_size).fill_(0)
+        if add_bias:
+            # Initialize the bias at 0
+            self.bias = empty(nb_models,out_size,1).fill_(0)
+            self.grdbias = empty(nb_models,out_size,1).fill_(0)
+        else:
+            # Else set it to None
+            self.bias = None
+            self.grdbias = None
+        # Flat views of the parameters and gradients when bound to an arena (see bind)
+        self.param = None
+        self.grdparam = None
+        self.init_weights()
+        # Initialize the inputs attribute
+        self.inputs = []
+        # Initialize the back flag (true if backpropagation has been performed)
+        self.back = False
+        
+    def init_weights(self):
+        """
+        Goal:
+        Initialize the weights of every member with Xavier Initialisation (in place)
+        Inputs:
+        Outputs:
+        """
+        _, out_size, in_size = self.weights.shape
+        xavier = math.sqrt(6/(in_size+out_size))
+        if self.generators is None:
+            self.weights.uniform_(-xavier,xavier)
+        else:
+            for k, generator in enumerate(self.generators):
+                self.weights[k].uniform_(-xavier,xavier,generator=generator)
+                
+    def forward(self,inputs,no_grad=False):
+        """
+        Goal:
+        Perform the forward step for all the members
+        Inputs:
+        inputs = torch tensor - size KxNxDin, or NxDin if all the members share the same input
+        Outputs:
+        output = torch tensor - size KxNxDout
+        """
+        if inputs.dim() == 2:
+            # Shared input: expand it without copy
+            inputs = inputs.expand(self.nb_models,*inputs.shape)
+        # Store the input into the input attribute (will be useful for the backward step)
+        if not no_grad:
+            self.inputs.append(inputs)
+        # Compute the output of all the members at once
+        if self.bias is not None:
+            output = torch.baddbmm(self.bias.transpose(1,2),inputs,self.weights.transpose(1,2))
+        else:
+            output = torch.bmm(inputs,self.weights.transpose(1,2))
+        return output
+        
+    def backward(self,grdwrtoutput):
+        """
+        Goal:
+        Perform the backward step for all the members
+        Inputs:
+        grdwrtoutput = torch tensor - size KxNxDout
+        Outputs:
+        grdwrtinput = torch tensor - size KxNxDin
+        """
+        # if the forward step has not been performed raise an error message
+        if len(self.inputs) == 0:
+            return "Forward step has not been performed"
+        inputs = self.inputs.pop()
+        # Compute the gradient with respect to the input
+        grdwrtinput = torch.bmm(grdwrtoutput,self.weights)
+        # Compute the gradient with respect to the weights and accumulate in place
+        self.grdweights.baddbmm_(grdwrtoutput.transpose(1,2),inputs)
+        if self.bias is not None:
+            # Compute the gradient with respect to the bias and accumulate
+            self.grdbias += grdwrtoutput.sum(dim=1).unsqueeze(2)
+        # Set the flag back to true --> means ready for the optimization step
+        self.back = True
+        return grdwrtinput
+    
+    def zero_grad(self):
+        """
+        Goal:
+        Reset the gradient tensors to zero (in place)
+        Inputs:
+        Outputs:
+        """
+        self.grdweights.zero_()
+        if self.bias is not None:
+            self.grdbias.zero_()
+            
+    def optimization_step(self,lr):
+        """
+        Goal:
+        Perform one optimization_step for all the members
+        Inputs:
+        lr = float > 0 or torch tensor of size K - learning rate (one per member if tensor)
+        Outputs:
+        """
+        # If the backward step has not been performed raise an error message
+        if not self.back:
+            return "Backward step has not been performed"
+        if torch.is_tensor(lr):
+            # One learning rate per member
+            lr = lr.view(-1,1,1)
+            self.weights.addcmul_(self.grdweights,lr,value=-1)
+            if self.bias is not None:
+                self.bias.addcmul_(self.grdbias,lr,value=-1)
+        else:
+            self.weights.add_(self.grdweights,alpha=-lr)
+            if self.bias is not None:
+                self.bias.add_(self.grdbias,alpha=-lr)
+        # Set the flag back to 0
+        self.back = False
+        
+    def reset(self):
+        """
+        Goal:
+        Reset the weigths and bias, reset also the gradient tensors to 0, reset the inputs attribute
+        Inputs:
+        Outputs:
+        """
+        self.init_weights()
+        if self.bias is not None:
+            self.bias.zero_()
+        self.zero_grad()
+        self.inputs = []
+        
+    def member(self,k):
+        """
+        Goal:
+        Extract the k-th member as an independent Linear layer
+        Inputs:
+        k = int - index of the member
+        Outputs:
+        layer = Linear - copy of the k-th member
+        """
+        _, out_size, in_size = self.weights.shape
+        layer = Linear(in_size,out_size,add_bias=self.bias is not None)
+        layer.weights.copy_(self.weights[k])
+        if self.bias is not None:
+            layer.bias.copy_(self.bias[k])
+        return layer
+        
+    @property
+    def size(self):
+        """
+        Goal:
+        Return the number of parameters of the layer (weights and bias of all the members)
+        Inputs:
+        Outputs:
+        size = int - number of parameters
+        """
+        nb_models, out_size, in_size = self.weights.shape
+        return nb_models*out_size*(in_size + (self.bias is not None))
+        
+    def bind(self,param,grdparam,copy=True):
+        """
+        Goal:
+        Store the weights, bias and their gradients as views into the given flat tensors
+        (see Sequential.flatten). Each member is laid out as one Dout x (Din [+1 if bias]) 
+        matrix, as in Linear.bind
+        Inputs:
+        param = torch tensor - flat tensor of size self.size
+        grdparam = torch tensor - flat tensor of size self.size
+        copy = bool - copy the current values of the parameters and gradients into the views
+        Outputs:
+        """
+        nb_models, out_size, in_size = self.weights.shape
+        param = param.view(nb_models,out_size,-1)
+        grdparam = grdparam.view(nb_models,out_size,-1)
+        if copy:
+            param[:,:,:in_size] = self.weights
+            grdparam[:,:,:in_size] = self.grdweights
+            if self.bias is not None:
+                param[:,:,in_size:] = self.bias
+                grdparam[:,:,in_size:] = self.grdbias
+        # Rebind the weights, bias and gradients to the views
+        self.param, self.grdparam = param, grdparam
+        self.weights, self.grdweights = param[:,:,:in_size], grdparam[:,:,:in_size]
+        if self.bias is not None:
+            self.bias, self.grdbias = param[:,:,in_size:], grdparam[:,:,in_size:]
+        
+    @property
+    def params(self):
+        """
+        Goal:
+        Return the weights, bias and their respective gradient tensor
+        Inputs:
+        Outputs:
+        param = torch tensor - size KxDoutxDin [+1 if bias]
+        grdparam = torch tensor - size KxDoutxDin [+1 if bias]
+        """
+        if self.param is not None:
+            # The layer is bound to an arena, return the views (no copy)
+            return self.param, self.grdparam
+        if self.bias is None:
+            return self.weights, self.grdweights
+        param = torch.cat((self.weights,self.bias),dim=2)
+        grdparam = torch.cat((self.grdweights,self.grdbias),dim=2)
+        return param, grdparam
@@ -0,0 +1,128 @@
+import math
+import queue
+import threading
+import torch
+
+
+def load_memmap(path,shape,dtype=torch.float32):
+    """
+    Goal:
+    Memory-map a raw binary file as a tensor, nothing is read until the rows are accessed
+    (copy-on-write, the file is never modified)
+    Inputs:
+    path = string - path of the file
+    shape = tuple - shape of the tensor stored in the file
+    dtype = torch dtype - type of the elements stored in the file
+    Outputs:
+    tensor = torch tensor - size shape, backed by the file
+    """
+    return torch.from_file(path,shared=False,size=math.prod(shape),dtype=dtype).view(shape)
+
+
+class DataLoader():
+    
+    def __init__(self,inputs,targets,mini_batch_size=100,shuffle=True,prefetch=False,generator=None):
+        """
+        Goal:
+        Iterate over the mini-batches of a data set. The data set is never copied: 
+        a new permutation of the indices is drawn at each epoch and only the rows of the
+        current mini-batch are gathered, so inputs can be bigger than the RAM 
+        (e.g. memory-mapped with load_memmap). The last mini-batch is smaller if N is not
+        a multiple of mini_batch_size
+        Inputs:
+        inputs = torch tensor - size NxDin
+        targets = torch tensor - size NxDout
+        mini_batch_size = int > 0 - size of the mini-batches
+        shuffle = bool - draw a new permutation at each epoch
+        prefetch = bool - gather the next mini-batch on a background thread
+        generator = torch Generator or None - generator used for the permutations
+        Outputs:
+        """
+        self.inputs = inputs
+        self.targets = targets
+        self.mini_batch_size = mini_batch_size
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.generator = generator
+        
+    def __len__(self):
+        """
+        Goal:
+        Return the number of mini-batches per epoch
+        Inputs:
+        Outputs:
+        """
+        return math.ceil(self.inputs.shape[0]/self.mini_batch_size)
+        
+    def batches(self,permutation=None):
+        """
+        Goal:
+        Generate the mini-batches of one epoch
+        Inputs:
+        permutation = torch tensor or None - order of the samples (None to keep the order of the data set)
+        Outputs:
+        (inputs, targets) = tuple of torch tensors - one mini-batch at a time
+        """
+        nb_samples = self.inputs.shape[0]
+        for b in range(0,nb_samples,self.mini_batch_size):
+            size = min(self.mini_batch_size,nb_samples - b)
+            if permutation is None:
+                # Views, no copy
+                yield self.inputs.narrow(0,b,size), self.targets.narrow(0,b,size)
+            else:
+                # Sort the indices of the mini-batch so that memory-mapped data is read in order
+                index = permutation.narrow(0,b,size).sort().values
+                yield self.inputs.index_select(0,index), self.targets.index_select(0,index)
+                
+    def __iter__(self):
+        """
+        Goal:
+        Generate the mini-batches of one epoch, prefetched on a background thread if self.prefetch
+        Inputs:
+        Outputs:
+        (inputs, targets) = tuple of torch tensors - one mini-batch at a time
+        """
+        permutation = None
+        if self.shuffle:
+            # Draw the permutation here so that the random state does not depend on the thread
+            permutation = torch.randperm(self.inputs.shape[0],generator=self.generator)
+        if not self.prefetch:
+            yield from self.batches(permutation)
+            return
+        batches = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        
+        def put(item):
+            # Put an item in the queue unless the consumer has stopped, returns True if put
+            while not stop.is_set():
+                try:
+                    batches.put(item,timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def producer():
+            try:
+                for batch in self.batches(permutation):
+                    if not put(batch):
+                        return
+            except Exception as error:
+                put(error)
+                return
+            put(None) # End of the epoch
+            
+        thread = threading.Thread(target=producer,daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch,Exception):
+                    raise batch
+                yield batch
+        finally:
+            # Also reached if the consumer stops early
+            stop.set()
+            thread.join()
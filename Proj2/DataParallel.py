@@ -0,0 +1,153 @@
+from MSELoss import *
+import torch
+import torch.multiprocessing as mp
+import threading
+import traceback
+
+
+def worker(rank,model,grdarenas,train_inputs,train_targets,
+           epochs,mini_batch_size,nb_workers,barrier,threads,timeout,errors):
+    """
+    Goal:
+    Loop executed by each worker process: compute the gradient of its shard of every mini-batch
+    into its own row of grdarenas, then wait for the main process to reduce them and update
+    the shared parameters
+    Inputs:
+    rank = int - index of the worker
+    model = Sequential - replica of the model, its parameters are in shared memory
+    grdarenas = torch tensor - size nb_workers x number of parameters, in shared memory
+    train_inputs, train_targets = torch tensors - training data
+    epochs = int - number of epochs
+    mini_batch_size = int - size of the mini-batch
+    nb_workers = int - number of workers
+    barrier = multiprocessing Barrier shared with the main process
+    threads = int - number of intra-op threads of the worker
+    timeout = float or None - maximal waiting time at the barrier in seconds
+    errors = multiprocessing SimpleQueue - the traceback of an exception is sent there
+    Outputs:
+    """
+    try:
+        torch.set_num_threads(threads)
+        # The parameters are shared, the gradients are written into the row of this worker
+        model.bind(model.arena,grdarenas[rank])
+        criterion = MSELoss()
+        nb_samples = train_inputs.shape[0]
+        for _ in range(epochs):
+            for b in range(0,nb_samples,mini_batch_size):
+                size = min(mini_batch_size,nb_samples - b)
+                # Bounds of the shard of this worker
+                start = b + rank*size//nb_workers
+                stop = b + (rank + 1)*size//nb_workers
+                model.zero_grad()
+                if stop > start:
+                    output = model.forward(train_inputs[start:stop])
+                    criterion.forward(output,train_targets[start:stop])
+                    # MSELoss averages over the shard, rescale so that the sum over the shards
+                    # is the gradient of the whole mini-batch
+                    grdwrtoutput = criterion.backward()*((stop - start)/size)
+                    model.backward(grdwrtoutput)
+                barrier.wait(timeout) # Gradients are ready
+                barrier.wait(timeout) # Parameters have been updated
+    except threading.BrokenBarrierError:
+        pass # Aborted by the main process or by another worker
+    except Exception:
+        errors.put((rank,traceback.format_exc()))
+        # Release the main process and the other workers
+        barrier.abort()
+        raise
+
+
+class DataParallel():
+    
+    def __init__(self,model,nb_workers=2,threads_per_worker=1,timeout=300):
+        """
+        Goal:
+        Data-parallel trainer: every mini-batch is split into nb_workers shards processed by
+        worker processes holding a replica of the model. The parameters live in shared memory,
+        the gradients of the workers are all-reduced in a fixed order by the main process
+        before the optimization step, so the results are reproducible and equal to the
+        single process training (train_my_model with shuffle=False) up to floating point rounding
+        Inputs:
+        model = Sequential - model to train
+        nb_workers = int > 0 - number of worker processes
+        threads_per_worker = int > 0 - number of intra-op threads of each worker
+        timeout = float or None - maximal waiting time (in seconds) of the processes for each 
+                  other at each step, a process that does not answer in time stops the training
+        Outputs:
+        """
+        self.model = model
+        self.timeout = timeout
+        self.nb_workers = nb_workers
+        self.threads_per_worker = threads_per_worker
+        if model.arena is None:
+            # Store all the parameters and gradients in two flat tensors
+            model.flatten()
+        # Move the parameters to shared memory (the layers keep their views)
+        model.arena.share_memory_()
+        # One row of gradients per worker
+        self.grdarenas = torch.zeros(nb_workers,model.arena.shape[0],dtype=model.arena.dtype).share_memory_()
+        
+    def train(self,train_inputs,train_targets,epochs=100,mini_batch_size=100,lr=5e-2,optimizer=None):
+        """
+        Goal:
+        Train the model, same arguments as train_my_model
+        Inputs:
+        train_inputs = torch tensor - size NxDin
+        train_targets = torch tensor - size NxDout
+        epochs = int - number of epochs
+        mini_batch_size = int - size of the mini-batch
+        lr = float > 0 - learning rate (used if optimizer is None)
+        optimizer = Optimizer or None - optimizer used for the update
+        Outputs:
+        Raises RuntimeError if a worker fails (with its traceback) or does not answer in time
+        """
+        context = mp.get_context("spawn")
+        barrier = context.Barrier(self.nb_workers + 1)
+        errors = context.SimpleQueue()
+        train_inputs = train_inputs.share_memory_()
+        train_targets = train_targets.share_memory_()
+        processes = []
+        for rank in range(self.nb_workers):
+            process = context.Process(target=worker,
+                                      args=(rank,self.model,self.grdarenas,train_inputs,train_targets,
+                                            epochs,mini_batch_size,self.nb_workers,barrier,
+                                            self.threads_per_worker,self.timeout,errors))
+            process.start()
+            processes.append(process)
+        try:
+            nb_samples = train_inputs.shape[0]
+            for _ in range(epochs):
+                for b in range(0,nb_samples,mini_batch_size):
+                    barrier.wait(self.timeout) # Wait for the gradients of all the workers
+                    # All-reduce: sum the gradients of the workers in a fixed order
+                    torch.sum(self.grdarenas,dim=0,out=self.model.grdarena)
+                    self.model.back = True
+                    if optimizer is not None:
+                        optimizer.step()
+                    else:
+                        self.model.optimization_step(lr)
+                    barrier.wait(self.timeout) # Release the workers
+        except threading.BrokenBarrierError:
+            # A worker failed or a process did not answer in time
+            failed = True
+        else:
+            failed = False
+        finally:
+            # Release the workers still waiting (no effect once the training is over)
+            barrier.abort()
+            for process in processes:
+                process.join(self.timeout)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+        messages = []
+        while not errors.empty():
+            rank, message = errors.get()
+            messages.append("Worker {:d} failed:\n{}".format(rank,message))
+        if messages:
+            raise RuntimeError("\n".join(messages))
+        if failed:
+            raise RuntimeError("DataParallel: a worker did not answer within the timeout")
+        exitcodes = [process.exitcode for process in processes]
+        if any(code != 0 for code in exitcodes):
+            raise RuntimeError("DataParallel: workers exited with codes " + str(exitcodes))
@@ -5,13 +5,17 @@ import math
 
 class Linear():
     
-    def __init__(self,in_size,out_size,add_bias=True):
+    def __init__(self,in_size,out_size,add_bias=True,reuse_buffers=False):
         """
         Goal:
         Inputs:
         in_size = int > 0 - Input size of the layer
         out_size = int > 0 - Output size of the layer
         add_bias = bool - Specify if you want to add a bias or not
+        reuse_buffers = bool - Write the outputs of forward and backward into preallocated
+                        workspaces (reallocated only when the batch size changes, the inference
+                        forward has its own workspace so that it does not resize the training ones).
+                        Warning: the returned tensors are overwritten by the next call
         Outputs:
         """
         # Initialize the weights and the associated gradient with Xavier Initialisation
@@ -31,6 +35,15 @@ class Linear():
         self.inputs = []
         # Initialize the back flag (true if backpropagation has been performed)
         self.back = False
+        # Initialize the workspaces used when reuse_buffers is True
+        self.reuse_buffers = reuse_buffers
+        self.output_buffer = None
+        self.inference_buffer = None
+        self.grdinput_buffer = None
+        self.grdbias_buffer = None
+        # Initialize the parameter matrices (set when the layer is bound to an arena, see bind)
+        self.param = None
+        self.grdparam = None
             
     def forward(self,inputs,no_grad=False):
         """
@@ -44,6 +57,17 @@ class Linear():
         # Store the input into the input attribute (will be useful for the backward step)
         if not no_grad:
             self.inputs.append(inputs) 
+        if self.reuse_buffers:
+            # Get the output workspace, sized by the batch (evaluation chunks and training
+            # mini-batches usually differ in size, each keeps its own workspace)
+            name = "inference_buffer" if no_grad else "output_buffer"
+            output = self.workspace(name,(inputs.shape[0],self.weights.shape[0]),inputs)
+            # Compute the output directly into the workspace
+            if self.bias is not None:
+                torch.addmm(self.bias.T,inputs,self.weights.T,out=output)
+            else:
+                torch.mm(inputs,self.weights.T,out=output)
+            return output
         # Compute the output
         output = inputs@(self.weights.T)
         if self.bias is not None:
@@ -63,13 +87,22 @@ class Linear():
         if len(self.inputs) == 0:
             return "Forward step has not been performed"
         inputs = self.inputs.pop()
-        # Compute the gradient with respect to the input and accumulate
-        grdwrtinput = grdwrtoutput@self.weights 
-        # Compute the gradient with respect to the weights
-        self.grdweights += (grdwrtoutput.T)@inputs
+        # Compute the gradient with respect to the input
+        if self.reuse_buffers:
+            grdwrtinput = self.workspace("grdinput_buffer",inputs.shape,grdwrtoutput)
+            torch.mm(grdwrtoutput,self.weights,out=grdwrtinput)
+        else:
+            grdwrtinput = grdwrtoutput@self.weights 
+        # Compute the gradient with respect to the weights and accumulate in place
+        self.grdweights.addmm_(grdwrtoutput.T,inputs)
         if self.bias is not None:
-            # Compute the gradient with respect to the bias and accumulate
-            self.grdbias += grdwrtoutput.sum(dim=0).view(-1,1)
+            # Compute the gradient with respect to the bias and accumulate in place
+            if self.reuse_buffers:
+                grdbias = self.workspace("grdbias_buffer",(self.weights.shape[0],),grdwrtoutput)
+                torch.sum(grdwrtoutput,dim=0,out=grdbias)
+                self.grdbias.add_(grdbias.view(-1,1))
+            else:
+                self.grdbias += grdwrtoutput.sum(dim=0).view(-1,1)
         # Set the flag back to true --> means ready for the optimization step
         self.back = True
         return grdwrtinput
@@ -81,10 +114,10 @@ class Linear():
         Inputs:
         Outputs:
         """
-        # Reset the gradient tensors
-        self.grdweights = empty(self.weights.shape).fill_(0)
+        # Reset the gradient tensors in place (no reallocation)
+        self.grdweights.zero_()
         if self.bias is not None:           
-            self.grdbias = empty(self.bias.shape).fill_(0)
+            self.grdbias.zero_()
         
     def optimization_step(self,lr):
         """
@@ -97,11 +130,11 @@ class Linear():
         # If the backward step has not been performed raise an error message
         if not self.back:
             return "Backward step has not been performed"
-        # Update the weights
-        self.weights -= self.grdweights*lr
+        # Update the weights in place (no temporary for grdweights*lr)
+        self.weights.add_(self.grdweights,alpha=-lr)
         if self.bias is not None:
             # Update the bias
-            self.bias -= self.grdbias*lr
+            self.bias.add_(self.grdbias,alpha=-lr)
         # Set the flag back to 0
         self.back = False
         
@@ -114,15 +147,72 @@ class Linear():
         """
         in_size, out_size = self.weights.shape # Get the shape of the layer
         xavier = math.sqrt(6/(in_size+out_size)) # Xavier Initialization
-        # Reset the weights
-        self.weights = empty(self.weights.shape).uniform_(-xavier,xavier)
+        # Reset the weights in place
+        self.weights.uniform_(-xavier,xavier)
         if self.bias is not None:
             # Reset the bias
-            self.bias = empty(self.bias.shape).fill_(0)
+            self.bias.zero_()
         # Set gradients to 0
         self.zero_grad()
-        # Reset the inputs to None
-        self.inputs = None
+        # Reset the inputs attribute (a list, so that forward can still be called)
+        self.inputs = []
+        
+    def workspace(self,name,shape,like):
+        """
+        Goal:
+        Return the preallocated workspace stored in the attribute "name",
+        reallocate it only if its shape (i.e. the batch size) has changed
+        Inputs:
+        name = string - name of the attribute storing the workspace
+        shape = torch.Size or tuple - required shape of the workspace
+        like = torch tensor - tensor giving the dtype of the workspace
+        Outputs:
+        buffer = torch tensor - size shape
+        """
+        buffer = getattr(self,name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != like.dtype:
+            buffer = empty(shape,dtype=like.dtype)
+            setattr(self,name,buffer)
+        return buffer
+        
+    @property
+    def size(self):
+        """
+        Goal:
+        Return the number of parameters of the layer (weights and bias)
+        Inputs:
+        Outputs:
+        size = int - number of parameters
+        """
+        out_size, in_size = self.weights.shape
+        return out_size*(in_size + (self.bias is not None))
+        
+    def bind(self,param,grdparam,copy=True):
+        """
+        Goal:
+        Store the weights, bias and their gradients as views into the given flat tensors
+        (see Sequential.flatten). The weights and bias of a layer are laid out as one
+        Dout x (Din [+1 if bias]) matrix, so that params returns views and not copies
+        Inputs:
+        param = torch tensor - flat tensor of size self.size
+        grdparam = torch tensor - flat tensor of size self.size
+        copy = bool - copy the current values of the parameters and gradients into the views
+        Outputs:
+        """
+        out_size, in_size = self.weights.shape
+        param = param.view(out_size,-1)
+        grdparam = grdparam.view(out_size,-1)
+        if copy:
+            param[:,:in_size] = self.weights
+            grdparam[:,:in_size] = self.grdweights
+            if self.bias is not None:
+                param[:,in_size:] = self.bias
+                grdparam[:,in_size:] = self.grdbias
+        # Rebind the weights, bias and gradients to the views
+        self.param, self.grdparam = param, grdparam
+        self.weights, self.grdweights = param[:,:in_size], grdparam[:,:in_size]
+        if self.bias is not None:
+            self.bias, self.grdbias = param[:,in_size:], grdparam[:,in_size:]
         
     @property
     def params(self):
@@ -136,7 +226,11 @@ class Linear():
         grdparam = torch tensor - 
                    size DoutxDin [+1 if bias] (Dout output size of the layer, Din input size of the layer)
         """
-        if self.bias is None:
+        if self.param is not None:
+            # The layer is bound to an arena, return the views (no copy)
+            param = self.param
+            grdparam = self.grdparam
+        elif self.bias is None:
             param = self.weights # Get the weights
             grdparam = self.grdweights # Get the gradient
         else:
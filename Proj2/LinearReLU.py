@@ -0,0 +1,58 @@
+from Linear import *
+
+
+class LinearReLU(Linear):
+    
+    def __init__(self,in_size,out_size,add_bias=True,reuse_buffers=False,inplace=False):
+        """
+        Goal:
+        Linear layer followed by ReLU, fused into a single module
+        Inputs:
+        in_size = int > 0 - Input size of the layer
+        out_size = int > 0 - Output size of the layer
+        add_bias = bool - Specify if you want to add a bias or not
+        reuse_buffers = bool - Write the outputs into preallocated workspaces (see Linear)
+        inplace = bool - Overwrite the gradient with respect to the output during the backward step
+        Outputs:
+        """
+        super().__init__(in_size,out_size,add_bias=add_bias,reuse_buffers=reuse_buffers)
+        self.inplace = inplace
+        # Initialize the list of masks (positive components of the output) used by the backward step
+        self.masks = []
+        
+    def forward(self,inputs,no_grad=False):
+        """
+        Goal:
+        Perform the forward step: affine transform then ReLU applied in place on its result
+        Inputs:
+        inputs = torch tensor - size NxDin (N number of datapoints, Din input size of the layer)
+        Outputs:
+        output = torch tensor - size NxDout (N number of datapoints, Dout output size of the layer)
+        """
+        # Compute the affine transform (stores the input if no_grad is False)
+        output = Linear.forward(self,inputs,no_grad=no_grad)
+        # Apply ReLU in place, no extra tensor is created
+        output.clamp_(min=0)
+        if not no_grad:
+            # Store a boolean mask rather than the pre-activation
+            self.masks.append(output > 0)
+        return output
+        
+    def backward(self,grdwrtoutput):
+        """
+        Goal:
+        Perform the backward step through ReLU then through the affine transform
+        Inputs:
+        grdwrtoutput = torch tensor - size NxDout (N number of datapoints, Dout input size of the layer)
+        Outputs:
+        grdwrtinput = torch tensor - size NxDin (N number of datapoints, Din input size of the layer)
+        """
+        if len(self.masks) == 0:
+            return "Forward step has not been performed"
+        mask = self.masks.pop()
+        # Use chain-rule to compute the gradient with respect to the pre-activation
+        if self.inplace:
+            grdwrtoutput = grdwrtoutput.mul_(mask)
+        else:
+            grdwrtoutput = grdwrtoutput*mask
+        return Linear.backward(self,grdwrtoutput)
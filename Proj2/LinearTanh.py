@@ -0,0 +1,61 @@
+from Linear import *
+
+
+class LinearTanh(Linear):
+    
+    def __init__(self,in_size,out_size,add_bias=True,reuse_buffers=False,inplace=False):
+        """
+        Goal:
+        Linear layer followed by tanh, fused into a single module
+        Inputs:
+        in_size = int > 0 - Input size of the layer
+        out_size = int > 0 - Output size of the layer
+        add_bias = bool - Specify if you want to add a bias or not
+        reuse_buffers = bool - Write the outputs into preallocated workspaces (see Linear)
+        inplace = bool - Overwrite the gradient with respect to the output during the backward step
+                  (the cached activation is the output returned by forward, it is never modified)
+        Outputs:
+        """
+        super().__init__(in_size,out_size,add_bias=add_bias,reuse_buffers=reuse_buffers)
+        self.inplace = inplace
+        # Initialize the list of outputs used by the backward step
+        self.outputs = []
+        
+    def forward(self,inputs,no_grad=False):
+        """
+        Goal:
+        Perform the forward step: affine transform then tanh applied in place on its result
+        Inputs:
+        inputs = torch tensor - size NxDin (N number of datapoints, Din input size of the layer)
+        Outputs:
+        output = torch tensor - size NxDout (N number of datapoints, Dout output size of the layer)
+        """
+        # Compute the affine transform (stores the input if no_grad is False)
+        output = Linear.forward(self,inputs,no_grad=no_grad)
+        # Apply tanh in place, no extra tensor is created
+        output.tanh_()
+        if not no_grad:
+            # Store the output, the derivative of tanh is 1 - tanh^2
+            self.outputs.append(output)
+        return output
+        
+    def backward(self,grdwrtoutput):
+        """
+        Goal:
+        Perform the backward step through tanh then through the affine transform
+        Inputs:
+        grdwrtoutput = torch tensor - size NxDout (N number of datapoints, Dout input size of the layer)
+        Outputs:
+        grdwrtinput = torch tensor - size NxDin (N number of datapoints, Din input size of the layer)
+        """
+        if len(self.outputs) == 0:
+            return "Forward step has not been performed"
+        output = self.outputs.pop()
+        # Use chain-rule to compute the gradient with respect to the pre-activation
+        if self.inplace:
+            # The cached output is the tensor returned by forward (e.g. the prediction held by
+            # the caller and MSELoss): compute 1 - tanh^2 in a new tensor, not in it
+            grdwrtoutput = grdwrtoutput.mul_(torch.mul(output,output).neg_().add_(1))
+        else:
+            grdwrtoutput = (1 - output*output)*grdwrtoutput
+        return Linear.backward(self,grdwrtoutput)
@@ -49,8 +49,10 @@ class MSELoss():
         if self.inputs is None or self.targets is None:
             return "Forward step has not been performed"
         if self.mean:
-            # Compute the gradient 
-            grdwrtinput = 2*(self.inputs-self.targets)/(self.inputs.shape[0])
+            # Compute the gradient (the samples are along the dimension -2 of an ensemble 
+            # output KxNxD, the leading dimension is the member)
+            nb_samples = self.inputs.shape[-2] if self.inputs.dim() > 2 else self.inputs.shape[0]
+            grdwrtinput = 2*(self.inputs-self.targets)/nb_samples
         else:
             grdwrtinput = 2*(self.inputs-self.targets)
         return grdwrtinput    
@@ -0,0 +1,219 @@
+from torch import empty
+import torch
+import math
+from abc import ABC, abstractmethod
+
+
+class Optimizer(ABC):
+    
+    def __init__(self,model,lr):
+        """
+        Goal:
+        Abstract base class of the optimizers, the subclasses implement update. The parameters 
+        and gradients of the model are stored in one flat tensor each (see Sequential.flatten) 
+        so that every update is a single vectorized operation over all the layers
+        Inputs:
+        model = Sequential - model to optimize
+        lr = float > 0 - learning rate
+        Outputs:
+        """
+        self.model = model
+        self.lr = lr
+        if model.arena is None:
+            # Store all the parameters and gradients in two flat tensors
+            model.flatten()
+        self.reset()
+        
+    def reset(self):
+        """
+        Goal:
+        Reset the state of the optimizer (nothing to reset for the base class)
+        Inputs:
+        Outputs:
+        """
+        pass
+    
+    def buffer(self):
+        """
+        Goal:
+        Allocate a state buffer of the size of the parameters, initialized to 0
+        Inputs:
+        Outputs:
+        buffer = torch tensor - flat tensor of the size of model.arena
+        """
+        return torch.zeros_like(self.model.arena)
+        
+    @abstractmethod
+    def update(self,param,grdparam):
+        """
+        Goal:
+        Update the parameters in place, implemented by the subclasses
+        Inputs:
+        param = torch tensor - flat tensor of all the parameters
+        grdparam = torch tensor - flat tensor of all the gradients
+        Outputs:
+        """
+        
+    def step(self):
+        """
+        Goal:
+        Perform one optimization step on the model
+        Inputs:
+        Outputs:
+        """
+        # If the backward step hasn't been performed, return an error message
+        if not self.model.back:
+            return "Backward step has not been performed"
+        self.update(self.model.arena,self.model.grdarena)
+        # Set the backward flags back to False
+        for module in self.model.modules_with_params():
+            module.back = False
+        self.model.back = False
+        
+    def zero_grad(self):
+        """
+        Goal:
+        Set all the gradients of the model to zero
+        Inputs:
+        Outputs:
+        """
+        self.model.zero_grad()
+
+
+class SGD(Optimizer):
+    
+    def __init__(self,model,lr=5e-2,momentum=0,nesterov=False,weight_decay=0):
+        """
+        Goal:
+        Stochastic gradient descent with (Nesterov) momentum and weight decay
+        Inputs:
+        model = Sequential - model to optimize
+        lr = float > 0 - learning rate
+        momentum = float >= 0 - momentum factor
+        nesterov = bool - use Nesterov momentum
+        weight_decay = float >= 0 - L2 penalty
+        Outputs:
+        """
+        if nesterov and momentum == 0:
+            raise ValueError("Nesterov momentum requires a momentum")
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.weight_decay = weight_decay
+        super().__init__(model,lr)
+        
+    def reset(self):
+        """
+        Goal:
+        Reset the momentum buffer
+        Inputs:
+        Outputs:
+        """
+        self.velocity = self.buffer() if self.momentum != 0 else None
+        # Workspace for the penalized or look-ahead gradient
+        use_grd = self.weight_decay != 0 or (self.nesterov and self.momentum != 0)
+        self.grd = self.buffer() if use_grd else None
+        
+    def update(self,param,grdparam):
+        """
+        Goal:
+        Update the parameters in place
+        Inputs:
+        param = torch tensor - flat tensor of all the parameters
+        grdparam = torch tensor - flat tensor of all the gradients
+        Outputs:
+        """
+        grd = grdparam
+        if self.weight_decay != 0:
+            # Add the L2 penalty to the gradient
+            grd = torch.add(grdparam,param,alpha=self.weight_decay,out=self.grd)
+        if self.velocity is not None:
+            # v = momentum*v + grd
+            self.velocity.mul_(self.momentum).add_(grd)
+            if self.nesterov:
+                # Look ahead: grd + momentum*v
+                grd = torch.add(grd,self.velocity,alpha=self.momentum,out=self.grd)
+            else:
+                grd = self.velocity
+        param.add_(grd,alpha=-self.lr)
+
+
+class Adam(Optimizer):
+    
+    def __init__(self,model,lr=1e-3,betas=(0.9,0.999),eps=1e-8,weight_decay=0,decoupled=False):
+        """
+        Goal:
+        Adam optimizer (AdamW if decoupled is True)
+        Inputs:
+        model = Sequential - model to optimize
+        lr = float > 0 - learning rate
+        betas = tuple of two floats in [0,1) - decay rates of the moment estimates
+        eps = float > 0 - term added to the denominator for numerical stability
+        weight_decay = float >= 0 - weight decay
+        decoupled = bool - apply the weight decay directly on the parameters (AdamW)
+                    instead of adding an L2 penalty to the gradient
+        Outputs:
+        """
+        self.betas = betas
+        self.eps = eps
+        self.weight_decay = weight_decay
+        self.decoupled = decoupled
+        super().__init__(model,lr)
+        
+    def reset(self):
+        """
+        Goal:
+        Reset the moment estimates and the step counter
+        Inputs:
+        Outputs:
+        """
+        self.t = 0
+        self.m = self.buffer() # First moment estimate
+        self.v = self.buffer() # Second moment estimate
+        self.denom = self.buffer() # Workspace for the denominator
+        self.grd = self.buffer() if self.weight_decay != 0 and not self.decoupled else None
+        
+    def update(self,param,grdparam):
+        """
+        Goal:
+        Update the parameters in place
+        Inputs:
+        param = torch tensor - flat tensor of all the parameters
+        grdparam = torch tensor - flat tensor of all the gradients
+        Outputs:
+        """
+        beta1, beta2 = self.betas
+        self.t += 1
+        grd = grdparam
+        if self.weight_decay != 0:
+            if self.decoupled:
+                # AdamW: decay the parameters directly
+                param.mul_(1 - self.lr*self.weight_decay)
+            else:
+                # Add the L2 penalty to the gradient
+                grd = torch.add(grdparam,param,alpha=self.weight_decay,out=self.grd)
+        # Update the biased moment estimates
+        self.m.mul_(beta1).add_(grd,alpha=1 - beta1)
+        self.v.mul_(beta2).addcmul_(grd,grd,value=1 - beta2)
+        # Bias corrections
+        correction1 = 1 - beta1**self.t
+        correction2 = 1 - beta2**self.t
+        # denom = sqrt(v/correction2) + eps
+        torch.sqrt(self.v,out=self.denom).div_(math.sqrt(correction2)).add_(self.eps)
+        param.addcdiv_(self.m,self.denom,value=-self.lr/correction1)
+
+
+class AdamW(Adam):
+    
+    def __init__(self,model,lr=1e-3,betas=(0.9,0.999),eps=1e-8,weight_decay=1e-2):
+        """
+        Goal:
+        Adam with decoupled weight decay
+        Inputs:
+        model = Sequential - model to optimize
+        lr = float > 0 - learning rate
+        betas = tuple of two floats in [0,1) - decay rates of the moment estimates
+        eps = float > 0 - term added to the denominator for numerical stability
+        weight_decay = float >= 0 - weight decay
+        Outputs:
+        """
+        super().__init__(model,lr=lr,betas=betas,eps=eps,weight_decay=weight_decay,decoupled=True)
@@ -24,8 +24,7 @@ class ReLU():
             # Add inputs to the attribute "input"
             self.inputs.append(inputs)
         # Set all negative components of input to zero to get ReLU of the inputs
-        output = inputs.clone()
-        output[inputs <= 0] = 0
+        output = inputs.clamp(min=0)
         return output
         
     def backward(self,grdwrtoutput):
@@ -40,11 +39,9 @@ class ReLU():
         if len(self.inputs) == 0:
             return "Forward step has not been performed"
         inputs = self.inputs.pop()
-        # grdphi contains the component-wise gradient of ReLU
-        grdphi = empty(inputs.shape).fill_(0)
-        grdphi[inputs > 0] = 1
         # Use chain-rule to compute gradient w.r.t. input from gradient w.r.t. output
-        grdwrtinput = grdphi*grdwrtoutput
+        # (the component-wise gradient of ReLU is the boolean mask inputs > 0)
+        grdwrtinput = grdwrtoutput*(inputs > 0)
         return grdwrtinput
         
     @property
@@ -1,3 +1,4 @@
+import torch
 from torch import empty
 
 """
@@ -9,18 +10,34 @@ backward step implementation a bit strange
 
 class Sequential():
     
-    def __init__(self,sequence,loss="MSE"):  # deleted the * before "sequence" so that a list of modules works
+    def __init__(self,sequence,loss="MSE",flat_params=False,checkpoints=None):  # deleted the * before "sequence" so that a list of modules works
         """
         Goal:
         Inputs: 
         sequence = list of modules
         loss = module of a loss
+        flat_params = bool - store all the parameters and gradients as views into 
+                      one flat contiguous tensor (see flatten)
+        checkpoints = None, int or list of int - gradient checkpointing: the sequence is split
+                      into segments (int = number of segments of equal length, list = indices of
+                      the modules starting a segment), only the inputs of the segments are stored
+                      by forward, the rest is recomputed segment by segment during backward
         Outputs:
         """
         # Initialize the sequence attribute, containing modules of models and losses
         self.sequence = sequence
         # Initialize the back flag (true if backpropagation has been performed)
         self.back = False
+        # Initialize the flat parameter and gradient tensors (None if not flattened)
+        self.arena = None
+        self.grdarena = None
+        if flat_params:
+            self.flatten()
+        # Initialize the checkpointing attributes
+        self.checkpoints = checkpoints
+        self.saved = [] # Inputs of the segments stored by forward
+        # Peak memory used by the stored activations (in bytes)
+        self.peak_activation_bytes = 0
         
     def forward(self,inputs,no_grad=False):
         """
@@ -33,9 +50,122 @@ class Sequential():
         """
         # Initialize the variable that will later contain the output
         output = inputs.clone()
-        # Perform the forward path by calling the forward method of every module in the sequence
+        if no_grad:
+            for module in self.sequence:
+                output = module.forward(output,no_grad=True)
+            return output
+        # Free the activations of a previous forward step not followed by a backward step
+        self.free_activations()
+        segments = self.segments()
+        for i, (start, stop) in enumerate(segments):
+            if i < len(segments) - 1:
+                # Only store the input of the segment
+                self.saved.append(output)
+                for module in self.sequence[start:stop]:
+                    output = module.forward(output,no_grad=True)
+            else:
+                # The last segment is needed right away by backward, store its activations
+                for module in self.sequence[start:stop]:
+                    output = module.forward(output)
+        self.update_peak()
+        return output
+
+    def segments(self):
+        """
+        Goal:
+        Return the segments used for gradient checkpointing
+        Inputs:
+        Outputs:
+        segments = list of tuples (start, stop) - indices of the modules of each segment
+        """
+        nb_modules = len(self.sequence)
+        if self.checkpoints is None:
+            return [(0,nb_modules)]
+        if isinstance(self.checkpoints,int):
+            nb_segments = max(1,min(self.checkpoints,nb_modules))
+            starts = [i*nb_modules//nb_segments for i in range(nb_segments)]
+        else:
+            starts = sorted(set([0] + [int(start) for start in self.checkpoints if 0 < start < nb_modules]))
+        return list(zip(starts,starts[1:] + [nb_modules]))
+
+    def activation_bytes(self):
+        """
+        Goal:
+        Compute the memory used by the activations currently stored by the modules and by the
+        checkpoints (each memory block is counted once)
+        Inputs:
+        Outputs:
+        nb_bytes = int - memory in bytes
+        """
+        storages = {}
+        tensors = list(self.saved)
+        for module in self.sequence:
+            for name in ("inputs","masks","outputs"):
+                stored = getattr(module,name,None)
+                if isinstance(stored,list):
+                    tensors += stored
+        for tensor in tensors:
+            storage = tensor.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+        return sum(storages.values())
+
+    def update_peak(self):
+        """
+        Goal:
+        Update the peak memory used by the stored activations
+        Inputs:
+        Outputs:
+        """
+        self.peak_activation_bytes = max(self.peak_activation_bytes,self.activation_bytes())
+
+    def free_activations(self):
+        """
+        Goal:
+        Free all the activations stored by the modules and by the checkpoints
+        Inputs:
+        Outputs:
+        """
+        self.saved = []
         for module in self.sequence:
-            output = module.forward(output,no_grad=no_grad)
+            for name in ("inputs","masks","outputs"):
+                stored = getattr(module,name,None)
+                if isinstance(stored,list):
+                    stored.clear()
+        
+    def forward_chunks(self,inputs,batch_size=1000):
+        """
+        Goal:
+        Perform the forward path for inference, chunk by chunk: no activation is stored
+        and the peak memory is bounded by the size of the chunks
+        Inputs:
+        inputs = torch tensor - size NxDin
+        batch_size = int > 0 - size of the chunks
+        Outputs:
+        (b, output) = int, torch tensor - index of the first sample of the chunk and output of the chunk
+        """
+        nb_samples = inputs.shape[0]
+        for b in range(0,nb_samples,batch_size):
+            size = min(batch_size,nb_samples - b)
+            yield b, self.forward(inputs.narrow(0,b,size),no_grad=True)
+
+    def predict(self,inputs,batch_size=1000):
+        """
+        Goal:
+        Compute the output of the model for inference, chunk by chunk (see forward_chunks)
+        Inputs:
+        inputs = torch tensor - size NxDin
+        batch_size = int > 0 - size of the chunks
+        Outputs:
+        output = torch tensor - size NxDout (KxNxDout for an ensemble of K models)
+        """
+        output = None
+        for b, chunk in self.forward_chunks(inputs,batch_size):
+            if output is None:
+                # Preallocate the output once its size is known (the samples are along the dimension -2)
+                shape = list(chunk.shape)
+                shape[-2] = inputs.shape[0]
+                output = empty(shape,dtype=chunk.dtype)
+            output.narrow(-2,b,chunk.shape[-2]).copy_(chunk)
         return output
         
     def backward(self,grdwrtoutput):
@@ -46,12 +176,23 @@ class Sequential():
         grdwrtoutput = torch tensor of size number of samples x size of the last layer // gradient with respect to the output
         Outputs:
         """
-        for module in reversed(self.sequence):
-            # Compute the gradients
-            grdwrtoutput = module.backward(grdwrtoutput)
-            if grdwrtoutput == "Forward step has not been performed":
-                message = str(type(module).__name__) + " : " + grdwrtoutput
-                return message
+        segments = self.segments()
+        for i in reversed(range(len(segments))):
+            start, stop = segments[i]
+            if i < len(segments) - 1:
+                # Recompute the activations of the segment from its stored input
+                if len(self.saved) == 0:
+                    return "Sequential : Forward step has not been performed"
+                output = self.saved.pop()
+                for module in self.sequence[start:stop]:
+                    output = module.forward(output)
+                self.update_peak()
+            for module in reversed(self.sequence[start:stop]):
+                # Compute the gradients
+                grdwrtoutput = module.backward(grdwrtoutput)
+                if isinstance(grdwrtoutput,str):
+                    message = str(type(module).__name__) + " : " + grdwrtoutput
+                    return message
         # Set the backward flag to true
         self.back = True
             
@@ -60,12 +201,20 @@ class Sequential():
         Goal: 
         update the weights using module.optimization_step for all the linear modules involved
         Inputs: 
-        lr = float > 0: learning rate
+        lr = float > 0 or torch tensor of size K: learning rate (one per member for ensembles)
         Outputs:
         """
         # If the backward step hasn't been performed, return an error message
         if not self.back:
             return "Backward step has not been performed"
+        if self.arena is not None and not torch.is_tensor(lr):
+            # Update all the parameters at once (a learning rate per ensemble member is
+            # applied by each layer, on its views of the arena)
+            self.arena.add_(self.grdarena,alpha=-lr)
+            for module in self.modules_with_params():
+                module.back = False
+            self.back = False
+            return
         # For every module that can be optimized, i.e. for the instances of Linear, update the weights
         for module in self.sequence:
             if hasattr(module,"optimization_step"):
@@ -79,6 +228,10 @@ class Sequential():
         Inputs: 
         Outputs:
         """
+        if self.arena is not None:
+            # Reset all the gradients at once
+            self.grdarena.zero_()
+            return
         for module in self.sequence:
             # Use the method zero_grad of all involved modules, which fulfill that purpose
             if hasattr(module,"zero_grad"):
@@ -95,6 +248,7 @@ class Sequential():
             # If the module has the attribute "reset", namely if its class is Linear, apply its reset method
             if hasattr(module,"reset"):
                 module.reset()
+        self.free_activations()
     
     @property
     def params(self):
@@ -112,4 +266,97 @@ class Sequential():
             if len(mod_params) > 0:
                 params.append(mod_params)
         return params
+
+    def modules_with_params(self):
+        """
+        Goal:
+        Return the modules owning parameters (i.e. the instances of Linear), each module only once
+        Inputs:
+        Outputs:
+        modules = list of modules
+        """
+        modules = []
+        for module in self.sequence:
+            if hasattr(module,"bind") and not any(module is other for other in modules):
+                modules.append(module)
+        return modules
+
+    def flatten(self):
+        """
+        Goal:
+        Allocate one flat contiguous tensor for all the parameters and one for all the gradients,
+        then store the weights, bias and gradients of every layer as views into them.
+        The optimization step, zero_grad, grad_norm and checkpointing then become a single 
+        vectorized operation
+        Inputs:
+        Outputs:
+        """
+        for module in self.sequence:
+            if hasattr(module,"weights") and not hasattr(module,"bind"):
+                raise TypeError(type(module).__name__ + " cannot be stored in a flat tensor (no bind method)")
+        modules = self.modules_with_params()
+        size = sum(module.size for module in modules)
+        dtype = modules[0].weights.dtype if len(modules) > 0 else None
+        arena = empty(size,dtype=dtype)
+        grdarena = empty(size,dtype=dtype)
+        self.bind(arena,grdarena,copy=True)
+
+    def bind(self,arena,grdarena,copy=False):
+        """
+        Goal:
+        Store the parameters and gradients of every layer as views into the given flat tensors
+        Inputs:
+        arena = torch tensor - flat tensor storing the parameters
+        grdarena = torch tensor - flat tensor storing the gradients
+        copy = bool - copy the current values of the parameters and gradients into the tensors
+        Outputs:
+        """
+        offset = 0
+        for module in self.modules_with_params():
+            size = module.size
+            module.bind(arena[offset:offset+size],grdarena[offset:offset+size],copy=copy)
+            offset += size
+        self.arena = arena
+        self.grdarena = grdarena
+
+    def grad_norm(self):
+        """
+        Goal:
+        Compute the euclidean norm of the gradient of all the parameters
+        Inputs:
+        Outputs:
+        norm = float - norm of the gradient
+        """
+        if self.arena is not None:
+            return self.grdarena.norm().item()
+        norm = 0
+        for module in self.modules_with_params():
+            norm += module.grdweights.pow(2).sum().item()
+            if module.bias is not None:
+                norm += module.grdbias.pow(2).sum().item()
+        return norm**0.5
+
+    def state(self):
+        """
+        Goal:
+        Return a checkpoint of the parameters (a copy of the flat parameter tensor)
+        Inputs:
+        Outputs:
+        state = torch tensor - flat tensor of all the parameters
+        """
+        if self.arena is None:
+            self.flatten()
+        return self.arena.clone()
+
+    def load_state(self,state):
+        """
+        Goal:
+        Restore the parameters from a checkpoint returned by state
+        Inputs:
+        state = torch tensor - flat tensor of all the parameters
+        Outputs:
+        """
+        if self.arena is None:
+            self.flatten()
+        self.arena.copy_(state)
        
\ No newline at end of file
@@ -1,25 +1,35 @@
 from torch import empty
+import torch
 
 class Tanh():
     
-    def __init__(self):
+    def __init__(self,dtype=None):
         """
         Goal:
         Inputs:
+        dtype = torch dtype or None - precision used to compute and store tanh 
+                (torch.float32, torch.float64 or torch.bfloat16), None to keep the precision of the input
         Outputs: 
         """
-        # Initialize the inputs attribute
-        self.inputs = []
+        if dtype not in (None,torch.float32,torch.float64,torch.bfloat16):
+            raise ValueError("dtype must be None, torch.float32, torch.float64 or torch.bfloat16")
+        self.dtype = dtype
+        # Initialize the outputs attribute (the backward step only needs tanh of the input)
+        self.outputs = []
         
     def tanh(self,x):
         """
         Goal:
+        Compute tanh in a numerically stable way: tanh(x) = sign(x)*(2/(1 + exp(-2|x|)) - 1)
+        exp is only evaluated on non positive values, so it can not overflow.
+        Only one tensor is allocated, all the other operations are performed in place
         Inputs: 
         x = torch tensor
         Outputs: 
         Component-wise tanh of the input = torch tensor of the same size
         """
-        return (x.exp() - (-x).exp())/(x.exp() + (-x).exp())
+        output = x.abs().mul_(-2).exp_()
+        return output.add_(1).reciprocal_().mul_(2).sub_(1).copysign_(x)
         
     def forward(self,inputs,no_grad=False):
         """
@@ -30,12 +40,15 @@ class Tanh():
         Outputs: 
         Torch tensor of the same size = tanh(input)
         """
+        if self.dtype is not None:
+            # Compute tanh in the requested precision
+            output = self.tanh(inputs.to(self.dtype))
+        else:
+            output = self.tanh(inputs)
         if not no_grad:
-            # Add inputs to the attribute "input"
-            self.inputs.append(inputs)
-        # Compute tanh of the input
-        output = self.tanh(inputs)
-        return output
+            # Add the output to the attribute "outputs" (used by the backward step)
+            self.outputs.append(output)
+        return output.to(inputs.dtype)
         
     def backward(self,grdwrtoutput):
         """
@@ -46,11 +59,14 @@ class Tanh():
         Outputs: 
         torch tensor of the same size storing the gradient with respect to the input
         """
-        if len(self.inputs) == 0:
+        if len(self.outputs) == 0:
             return "Forward step has not been performed"
-        inputs = self.inputs.pop()
-        # Compute the gradient using chain rule and return it
-        grdwrtinput = (1 - self.tanh(inputs)**2)*grdwrtoutput
+        output = self.outputs.pop()
+        # Compute the gradient using chain rule (derivative of tanh = 1 - tanh^2)
+        # The cached output may still be used by the caller so only one new tensor is allocated
+        grdphi = output*output
+        grdphi = grdphi.neg_().add_(1).to(grdwrtoutput.dtype)
+        grdwrtinput = grdphi.mul_(grdwrtoutput)
         return grdwrtinput
         
     @property
@@ -61,4 +77,4 @@ class Tanh():
         Inputs:
         Outputs:
         """
-        return []
\ No newline at end of file
+        return []
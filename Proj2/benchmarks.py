@@ -0,0 +1,186 @@
+from utils import *
+from torch.profiler import profile, ProfilerActivity
+from time import perf_counter
+import torch
+
+
+def count_allocations(model, inputs, targets, lr=5e-2, steps=10):
+    """
+    Goal:
+    Count the number of tensor allocations performed by one training step
+    (forward, loss, zero_grad, backward and optimization_step)
+    Inputs:
+    model = Sequential - model to train
+    inputs = torch tensor - size NxDin, one mini-batch
+    targets = torch tensor - size NxDout, targets of the mini-batch
+    lr = float > 0 - learning rate
+    steps = int > 0 - number of steps over which the count is averaged
+    Outputs:
+    allocations = float - average number of allocations per step
+    """
+    criterion = MSELoss()
+
+    def step():
+        output = model.forward(inputs)
+        criterion.forward(output, targets)
+        grdwrtoutput = criterion.backward()
+        model.zero_grad()
+        model.backward(grdwrtoutput)
+        model.optimization_step(lr)
+
+    # Warm-up step so that the workspaces are already allocated
+    step()
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        for _ in range(steps):
+            step()
+    # Count the operators which allocate memory themselves (not through a child operator)
+    allocations = sum(1 for event in prof.events() if event.self_cpu_memory_usage > 0)
+    return allocations/steps
+
+
+class BaselineLinear(Linear):
+    """
+    Linear layer as it was before reuse_buffers: zero_grad reallocates the gradients and the
+    gradients and updates go through temporaries (the "before" arm of bench_buffers)
+    """
+
+    def backward(self,grdwrtoutput):
+        if len(self.inputs) == 0:
+            return "Forward step has not been performed"
+        inputs = self.inputs.pop()
+        grdwrtinput = grdwrtoutput@self.weights
+        self.grdweights += (grdwrtoutput.T)@inputs
+        if self.bias is not None:
+            self.grdbias += grdwrtoutput.sum(dim=0).view(-1,1)
+        self.back = True
+        return grdwrtinput
+
+    def zero_grad(self):
+        self.grdweights = empty(self.weights.shape).fill_(0)
+        if self.bias is not None:
+            self.grdbias = empty(self.bias.shape).fill_(0)
+
+    def optimization_step(self,lr):
+        if not self.back:
+            return "Backward step has not been performed"
+        self.weights -= self.grdweights*lr
+        if self.bias is not None:
+            self.bias -= self.grdbias*lr
+        self.back = False
+
+
+def baseline_model(nb_layers=3, layer_size=16):
+    # Same architecture as create_model, built with BaselineLinear layers
+    relu = ReLU()
+    sequence = [BaselineLinear(2, layer_size), relu]
+    for i in range(nb_layers):
+        sequence += [BaselineLinear(layer_size, layer_size), relu]
+    sequence += [BaselineLinear(layer_size, 1), Tanh()]
+    return Sequential(sequence)
+
+
+def bench_buffers(nb_layers=3, layer_size=16, mini_batch_size=100):
+    """
+    Goal:
+    Print the number of allocations per training step before the buffer reuse (baseline Linear)
+    and after it, with and without reuse_buffers
+    Inputs:
+    nb_layers = int - number of hidden layers
+    layer_size = int - size of the hidden layers
+    mini_batch_size = int - size of the mini-batch
+    Outputs:
+    """
+    inputs, targets = generate_disc_set(mini_batch_size)
+    configs = [("baseline", baseline_model(nb_layers, layer_size)),
+               ("reuse_buffers = False", create_model(nb_layers, layer_size, reuse_buffers=False)),
+               ("reuse_buffers = True", create_model(nb_layers, layer_size, reuse_buffers=True))]
+    for name, model in configs:
+        allocations = count_allocations(model, inputs, targets.float())
+        print("{:<22} allocations per step = {:.1f}".format(name, allocations))
+
+
+def time_to_accuracy(model, train_inputs, train_targets, test_inputs, test_targets,
+                     target=95, max_epochs=500, mini_batch_size=100, lr=5e-2, optimizer=None):
+    """
+    Goal:
+    Train a model epoch by epoch until its test accuracy reaches the target
+    Inputs:
+    model = Sequential - model to train
+    train_inputs, train_targets = torch tensors - training data
+    test_inputs, test_targets = torch tensors - testing data
+    target = float - test accuracy to reach (in percentage)
+    max_epochs = int - maximum number of epochs
+    mini_batch_size = int - size of the mini-batch
+    lr = float > 0 - learning rate of the plain loop (used if optimizer is None)
+    optimizer = Optimizer or None - optimizer to use
+    Outputs:
+    epochs = int - number of epochs needed (None if the target is not reached)
+    elapsed = float - training time in seconds (evaluation excluded)
+    """
+    elapsed = 0
+    for epochs in range(1, max_epochs + 1):
+        start = perf_counter()
+        train_my_model(model, train_inputs, train_targets, epochs=1,
+                       mini_batch_size=mini_batch_size, lr=lr, optimizer=optimizer)
+        elapsed += perf_counter() - start
+        if compute_nb_errors(model, test_inputs, test_targets) >= target:
+            return epochs, elapsed
+    return None, elapsed
+
+
+def bench_optimizers(target=95, max_epochs=500, seed=0):
+    """
+    Goal:
+    Print the time to reach the target test accuracy for the plain loop of train_my_model
+    and for each optimizer
+    Inputs:
+    target = float - test accuracy to reach (in percentage)
+    max_epochs = int - maximum number of epochs
+    seed = int - seed used to generate the data and initialize the models
+    Outputs:
+    """
+    torch.manual_seed(seed)
+    train_inputs, train_targets = generate_disc_set(1000)
+    test_inputs, test_targets = generate_disc_set(1000)
+    train_targets, test_targets = train_targets.float(), test_targets.float()
+    configs = [("plain loop", None),
+               ("SGD momentum", lambda model: SGD(model, lr=5e-2, momentum=0.9)),
+               ("SGD Nesterov", lambda model: SGD(model, lr=5e-2, momentum=0.9, nesterov=True)),
+               ("Adam", lambda model: Adam(model, lr=1e-2)),
+               ("AdamW", lambda model: AdamW(model, lr=1e-2))]
+    for name, make_optimizer in configs:
+        torch.manual_seed(seed)
+        model = create_model()
+        optimizer = make_optimizer(model) if make_optimizer is not None else None
+        epochs, elapsed = time_to_accuracy(model, train_inputs, train_targets, test_inputs, test_targets,
+                                           target=target, max_epochs=max_epochs, optimizer=optimizer)
+        print("{:<15} epochs = {:<6} time = {:.3f}s".format(name, str(epochs), elapsed))
+
+
+def bench_ensemble(nb_models=8, epochs=20, seed=0):
+    """
+    Goal:
+    Print the time needed to train nb_models models one after another and as one ensemble
+    Inputs:
+    nb_models = int - number of models
+    epochs = int - number of epochs
+    seed = int - seed used to generate the data
+    Outputs:
+    """
+    torch.manual_seed(seed)
+    train_inputs, train_targets = generate_disc_set(1000)
+    train_targets = train_targets.float()
+    start = perf_counter()
+    for _ in range(nb_models):
+        train_my_model(create_model(), train_inputs, train_targets, epochs=epochs)
+    sequential_time = perf_counter() - start
+    start = perf_counter()
+    train_my_model(create_ensemble(nb_models), train_inputs, train_targets, epochs=epochs)
+    ensemble_time = perf_counter() - start
+    print("{} models: one after another = {:.3f}s, ensemble = {:.3f}s".format(nb_models, sequential_time, ensemble_time))
+
+
+if __name__ == "__main__":
+    bench_buffers()
+    bench_optimizers()
+    bench_ensemble()
@@ -1,5 +1,11 @@
+from BatchedLinear import *
+from DataLoader import *
+from DataParallel import *
 from Linear import *
+from LinearReLU import *
+from LinearTanh import *
 from MSELoss import *
+from Optimizer import *
 from ReLU import *
 from Sequential import *
 from Tanh import *
@@ -16,66 +22,128 @@ def generate_disc_set(nb=1000):
     train_target[train_target == 0] = -1
     return train_set, train_target.view(-1,1)
 
-def create_model(nb_layers=3, layer_size=16):
-    fc1 = Linear(2, layer_size)
+def create_model(nb_layers=3, layer_size=16, reuse_buffers=False, flat_params=False,
+                 fused=False, inplace=False, checkpoints=None):
+    if fused:
+        # Each Linear and its activation are computed by a single module
+        sequence = [LinearReLU(2, layer_size, reuse_buffers=reuse_buffers, inplace=inplace)]
+        for i in range(nb_layers):
+            sequence.append(LinearReLU(layer_size, layer_size, reuse_buffers=reuse_buffers, inplace=inplace))
+        sequence.append(LinearTanh(layer_size, 1, reuse_buffers=reuse_buffers, inplace=inplace))
+        return Sequential(sequence, flat_params=flat_params, checkpoints=checkpoints)
+    fc1 = Linear(2, layer_size, reuse_buffers=reuse_buffers)
     tanh = Tanh()
     relu = ReLU()
     layers_list = []
     for i in range(nb_layers):
-        fc = Linear(layer_size, layer_size)
+        fc = Linear(layer_size, layer_size, reuse_buffers=reuse_buffers)
         layers_list.append(fc)
         layers_list.append(relu)
-    fc2 = Linear(layer_size, 1)
+    fc2 = Linear(layer_size, 1, reuse_buffers=reuse_buffers)
     sequence = [fc1, relu] + layers_list + [fc2, tanh]
+    return Sequential(sequence, flat_params=flat_params, checkpoints=checkpoints)
+
+def create_ensemble(nb_models, nb_layers=3, layer_size=16, seeds=None):
+    # Same architecture as create_model, the K members are trained at once
+    generators = None
+    if seeds is not None:
+        generators = [torch.Generator().manual_seed(seed) for seed in seeds]
+    fc1 = BatchedLinear(nb_models, 2, layer_size, generators=generators)
+    tanh = Tanh()
+    relu = ReLU()
+    layers_list = []
+    for i in range(nb_layers):
+        fc = BatchedLinear(nb_models, layer_size, layer_size, generators=generators)
+        layers_list.append(fc)
+        layers_list.append(relu)
+    fc2 = BatchedLinear(nb_models, layer_size, 1, generators=generators)
+    sequence = [fc1, relu] + layers_list + [fc2, tanh]
+    return Sequential(sequence)
+
+def ensemble_member(model, k):
+    # Extract the k-th member of an ensemble as an independent model
+    # The activations store their inputs/outputs between forward and backward, so the member gets
+    # new instances (an activation used at several positions, as in create_model, stays shared)
+    activations = {}
+    sequence = []
+    for module in model.sequence:
+        if hasattr(module, "member"):
+            sequence.append(module.member(k))
+            continue
+        if id(module) not in activations:
+            activations[id(module)] = Tanh(module.dtype) if isinstance(module, Tanh) else type(module)()
+        sequence.append(activations[id(module)])
     return Sequential(sequence)
 
-def compute_nb_errors(model, data_input, data_target):
-    output = model.forward(data_input, no_grad=True)
-    output[output < 0] = -1
-    output[output >= 0] = 1
-    nb_errors = ((data_target != output)*1).sum()
+def compute_nb_errors(model, data_input, data_target, batch_size=1000):
+    # Evaluate chunk by chunk, the prediction is the sign of the output
+    nb_errors = 0
+    for b, output in model.forward_chunks(data_input, batch_size):
+        target = data_target.narrow(0, b, output.shape[0])
+        nb_errors += ((output >= 0) != (target > 0)).sum().item()
     accuracy = (1 - nb_errors/data_input.shape[0])*100
-    return accuracy.item()
+    return accuracy
+
+def compute_ensemble_accuracy(model, data_input, data_target, batch_size=1000):
+    # Accuracy of each member of an ensemble, returns a tensor of size K
+    nb_errors = 0
+    for b, output in model.forward_chunks(data_input, batch_size):
+        target = data_target.narrow(0, b, output.shape[-2])
+        nb_errors += ((output >= 0) != (target > 0)).sum(dim=(1,2))
+    accuracy = (1 - nb_errors/data_input.shape[0])*100
+    return accuracy
 
 def train_my_model(model,train_inputs,train_targets,
-                   epochs=100,mini_batch_size=100,lr=5e-2):
+                   epochs=100,mini_batch_size=100,lr=5e-2,optimizer=None,
+                   shuffle=True,prefetch=False):
     criterion = MSELoss()
+    loader = DataLoader(train_inputs, train_targets, mini_batch_size, shuffle=shuffle, prefetch=prefetch)
     for _ in range(epochs):
-        for b in range(0,train_inputs.shape[0],mini_batch_size):
-            inputs = train_inputs.narrow(0, b, mini_batch_size)
+        for inputs, target in loader:
             output = model.forward(inputs)
-            target = train_targets.narrow(0, b, mini_batch_size)
             loss = criterion.forward(output,target)
             grdwrtoutput= criterion.backward()
             model.zero_grad()
             model.backward(grdwrtoutput)
-            model.optimization_step(lr)
+            if optimizer is not None:
+                optimizer.step()
+            else:
+                model.optimization_step(lr)
 
 
 def train_model(model, train_input, train_target, test_input, test_target,
                 nb_epochs = 200, mini_batch_size = 100, lr = 5e-2,
-               create_plot=False, title="error using mean-squares loss"):
+               create_plot=False, title="error using mean-squares loss", optimizer=None,
+               shuffle=True, prefetch=False):
     # still need to add the figure
     
     model.reset()
+    if optimizer is not None:
+        optimizer.reset()
     
     if create_plot:
         train_errors, test_errors = [], []
     
+    loader = DataLoader(train_input, train_target, mini_batch_size, shuffle=shuffle, prefetch=prefetch)
+    
     for e in range(nb_epochs):
         
-        for b in range(0, train_input.size(0), mini_batch_size):
-            output = model.forward((train_input.narrow(0, b, mini_batch_size)))
+        for inputs, target in loader:
+            output = model.forward(inputs)
             mse = MSELoss() #create an instance of MSELoss
-            loss = mse.forward(output,train_target.narrow(0, b, mini_batch_size))
+            loss = mse.forward(output,target)
             grdwrtoutput = mse.backward()
             model.zero_grad()
             model.backward(grdwrtoutput)
-            model.optimization_step(lr)
+            if optimizer is not None:
+                optimizer.step()
+            else:
+                model.optimization_step(lr)
 
         if create_plot:
-            train_error = compute_nb_errors(model, train_input, train_target, batch_size=mini_batch_size)/train_input.size(0)
-            test_error = compute_nb_errors(model, test_input, test_target, batch_size=mini_batch_size)/test_input.size(0)
+            # compute_nb_errors returns the accuracy in percentage
+            train_error = 1 - compute_nb_errors(model, train_input, train_target)/100
+            test_error = 1 - compute_nb_errors(model, test_input, test_target)/100
             train_errors.append(train_error)
             test_errors.append(test_error)
             